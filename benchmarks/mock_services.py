@@ -0,0 +1,229 @@
+"""Local stand-ins for the OpenAI and SAP endpoints the agents call.
+
+One app serves both so a benchmark only needs one extra port:
+
+    OpenAI  POST /v1/embeddings, POST /v1/chat/completions
+    SAP     POST /oauth/token, POST /sap/{action}, POST /sap/$batch (OData)
+    Stats   GET /stats (calls and embedded texts per endpoint since start)
+
+Latency and error injection are read from the environment:
+
+    MOCK_EMBED_LATENCY_MS   per embeddings call (default 40)
+    MOCK_EMBED_ITEM_MS      extra per input text (default 0.5)
+    MOCK_CHAT_LATENCY_MS    per chat completion (default 400)
+    MOCK_FAST_MODELS        comma-separated models treated as fast tier (default gpt-4o-mini)
+    MOCK_FAST_LATENCY_MS    per chat completion by a fast model (default 150)
+    MOCK_FAST_REFUSAL_RATE  fraction of fast-model answers that decline to answer (default 0.2)
+    MOCK_SAP_TOKEN_MS       per token request (default 80)
+    MOCK_SAP_LATENCY_MS     per SAP action call (default 250)
+    MOCK_SAP_BATCH_ITEM_MS  extra per item in a $batch call (default 2)
+    MOCK_JITTER             +/- fraction applied to every delay (default 0.2)
+    MOCK_ERROR_RATE         fraction of calls answered with HTTP 500 (default 0)
+
+    uvicorn mock_services:app --port 18999
+"""
+import asyncio
+import base64
+import collections
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import uuid
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+EMBEDDING_DIM = 1536
+
+EMBED_LATENCY_MS = float(os.getenv("MOCK_EMBED_LATENCY_MS", "40"))
+EMBED_ITEM_MS = float(os.getenv("MOCK_EMBED_ITEM_MS", "0.5"))
+CHAT_LATENCY_MS = float(os.getenv("MOCK_CHAT_LATENCY_MS", "400"))
+FAST_MODELS = set(os.getenv("MOCK_FAST_MODELS", "gpt-4o-mini").split(","))
+FAST_LATENCY_MS = float(os.getenv("MOCK_FAST_LATENCY_MS", "150"))
+FAST_REFUSAL_RATE = float(os.getenv("MOCK_FAST_REFUSAL_RATE", "0.2"))
+SAP_TOKEN_MS = float(os.getenv("MOCK_SAP_TOKEN_MS", "80"))
+SAP_LATENCY_MS = float(os.getenv("MOCK_SAP_LATENCY_MS", "250"))
+SAP_BATCH_ITEM_MS = float(os.getenv("MOCK_SAP_BATCH_ITEM_MS", "2"))
+JITTER = float(os.getenv("MOCK_JITTER", "0.2"))
+ERROR_RATE = float(os.getenv("MOCK_ERROR_RATE", "0"))
+
+app = FastAPI()
+STATS = collections.Counter()
+
+
+async def delay(ms):
+    await asyncio.sleep(max(0.0, ms * (1 + random.uniform(-JITTER, JITTER))) / 1000.0)
+
+
+def injected_error():
+    if random.random() < ERROR_RATE:
+        return JSONResponse(status_code=500, content={"error": {"message": "injected failure", "type": "server_error"}})
+    return None
+
+
+def embed(text):
+    """Hashed bag-of-words vector, so similar texts retrieve similar documents"""
+    vec = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        vec[int.from_bytes(hashlib.blake2b(word.encode(), digest_size=4).digest(), "little") % EMBEDDING_DIM] += 1.0
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+def count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+@app.get("/health")
+def health_check():
+    return {"status": "ok"}
+
+
+@app.get("/stats")
+def stats():
+    return dict(STATS)
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    STATS["embedding_calls"] += 1
+    STATS["embedded_texts"] += len(inputs)
+    await delay(EMBED_LATENCY_MS + EMBED_ITEM_MS * len(inputs))
+    error = injected_error()
+    if error:
+        return error
+    as_base64 = body.get("encoding_format") == "base64"
+    data = []
+    for i, text in enumerate(inputs):
+        vec = embed(text)
+        data.append({
+            "object": "embedding",
+            "index": i,
+            "embedding": base64.b64encode(vec.tobytes()).decode() if as_base64 else vec.tolist()
+        })
+    tokens = sum(count_tokens(text) for text in inputs)
+    return {
+        "object": "list",
+        "data": data,
+        "model": body.get("model", "text-embedding-ada-002"),
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+    model = body.get("model", "gpt-3.5-turbo")
+    fast = model in FAST_MODELS
+    await delay(FAST_LATENCY_MS if fast else CHAT_LATENCY_MS)
+    error = injected_error()
+    if error:
+        return error
+    context = prompt.split("Documents:", 1)[-1].strip()
+    if fast and random.random() < FAST_REFUSAL_RATE:
+        answer = "This is not covered in the provided documents."
+    else:
+        answer = "According to the company documents: " + context.splitlines()[0][:200] if context else "Not found."
+    finish_reason = "stop"
+    max_tokens = body.get("max_tokens")
+    if max_tokens and count_tokens(answer) > max_tokens:
+        answer, finish_reason = answer[:max_tokens * 4], "length"
+    prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(answer)
+    STATS["chat_calls"] += 1
+    STATS[f"chat_calls:{model}"] += 1
+    STATS[f"prompt_tokens:{model}"] += prompt_tokens
+    STATS[f"completion_tokens:{model}"] += completion_tokens
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": finish_reason}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+
+@app.post("/oauth/token")
+async def sap_token():
+    STATS["sap_token_calls"] += 1
+    await delay(SAP_TOKEN_MS)
+    error = injected_error()
+    if error:
+        return error
+    return {"access_token": uuid.uuid4().hex, "token_type": "bearer", "expires_in": 3600}
+
+
+def multipart_parts(content_type, body):
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1)
+    parts = []
+    for part in body.replace("\r\n", "\n").split(f"--{boundary}")[1:]:
+        if part.startswith("--"):
+            break
+        headers, _, content = part.strip("\n").partition("\n\n")
+        parts.append((headers, content))
+    return parts
+
+
+def http_part(status, reason, body):
+    return "\r\n".join([
+        "Content-Type: application/http",
+        "Content-Transfer-Encoding: binary",
+        "",
+        f"HTTP/1.1 {status} {reason}",
+        "Content-Type: application/json",
+        "",
+        body
+    ])
+
+
+@app.post("/sap/$batch")
+async def sap_batch(request: Request):
+    """OData $batch: one response per change set; a failed change set gets a single error"""
+    body = (await request.body()).decode()
+    changesets = multipart_parts(request.headers["content-type"], body)
+    STATS["sap_batch_calls"] += 1
+    items = 0
+    out_boundary = f"batchresponse_{uuid.uuid4().hex}"
+    lines = []
+    for headers, content in changesets:
+        operations = multipart_parts(re.search(r"Content-Type: (multipart/mixed;[^\n]+)", headers).group(1), content)
+        items += len(operations)
+        lines.append(f"--{out_boundary}")
+        if random.random() < ERROR_RATE:
+            lines.append(http_part(400, "Bad Request", json.dumps({"error": {"message": "injected failure"}})))
+            continue
+        changeset_boundary = f"changesetresponse_{uuid.uuid4().hex}"
+        lines += [f"Content-Type: multipart/mixed; boundary={changeset_boundary}", ""]
+        for _, operation in operations:
+            payload = operation.split("\n\n", 1)[-1].strip()
+            lines += [f"--{changeset_boundary}", http_part(201, "Created", json.dumps({"id": uuid.uuid4().hex, "payload": json.loads(payload)}))]
+        lines.append(f"--{changeset_boundary}--")
+    lines.append(f"--{out_boundary}--")
+    await delay(SAP_LATENCY_MS + SAP_BATCH_ITEM_MS * items)
+    return Response(
+        content="\r\n".join(lines) + "\r\n",
+        status_code=202,
+        media_type=f"multipart/mixed; boundary={out_boundary}"
+    )
+
+
+@app.post("/sap/{action}")
+async def sap_action(action: str, request: Request):
+    payload = await request.json()
+    STATS["sap_calls"] += 1
+    await delay(SAP_LATENCY_MS)
+    error = injected_error()
+    if error:
+        return error
+    return JSONResponse(status_code=201, content={"status": "created", "action": action, "id": uuid.uuid4().hex, "payload": payload})
@@ -0,0 +1,124 @@
+"""Throughput vs latency of query micro-batching for different batch windows.
+
+Loads an agent module with a local stand-in for the OpenAI embeddings client
+(fixed per-call latency, small per-item cost and a cap on concurrent calls, the
+way the real API rate-limits) and drives ``Corpus.search_docs`` from many threads.
+
+    python benchmarks/query_batching.py --agent hr --windows 0,2,5,10,20
+"""
+import argparse
+import hashlib
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+import openai
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMBEDDING_DIM = 1536
+
+
+class FakeEmbeddingAPI:
+    """Emulates the embeddings endpoint: latency per call, not per input"""
+
+    def __init__(self, latency_ms, per_item_ms, max_inflight):
+        self.latency = latency_ms / 1000.0
+        self.per_item = per_item_ms / 1000.0
+        self.slots = threading.BoundedSemaphore(max_inflight)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.items = 0
+
+    def create(self, input, model, **kwargs):
+        with self.slots:
+            time.sleep(self.latency + self.per_item * len(input))
+        with self.lock:
+            self.calls += 1
+            self.items += len(input)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=embed(text)) for text in input])
+
+
+def embed(text):
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+    return np.random.default_rng(seed).random(EMBEDDING_DIM, dtype=np.float32)
+
+
+def load_agent(name, api):
+    """Import src/agents/<name>_agent/main.py with the fake OpenAI client patched in"""
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ["QUERY_BATCH_WINDOW_MS"] = "0"
+    openai.OpenAI = lambda **kwargs: SimpleNamespace(embeddings=api, chat=SimpleNamespace(completions=None))
+    sys.path.insert(0, os.path.join(ROOT, "src", "agents"))
+    module = importlib.import_module(f"{name}_agent.main")
+    logging.getLogger().setLevel(logging.WARNING)
+    return module
+
+
+def percentile(samples, pct):
+    return float(np.percentile(samples, pct)) * 1000 if samples else 0.0
+
+
+def run(agent, api, window_ms, args):
+    from agent_common.retrieval import QueryBatcher  # importable once load_agent has run
+
+    corpus = agent.CORPUS
+    corpus.batcher = (
+        QueryBatcher(corpus.index, window_ms, args.max_batch, args.batch_workers) if window_ms > 0 else None
+    )
+    api.calls = api.items = 0
+    queries = [f"How many leave days do I get? variant {i % 50}" for i in range(args.requests)]
+    latencies = []
+
+    def one(query):
+        start = time.perf_counter()
+        corpus.search_docs(query)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, queries))
+    elapsed = time.perf_counter() - start
+    return {
+        "window_ms": window_ms,
+        "throughput": len(queries) / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "calls": api.calls,
+        "avg_batch": api.items / api.calls if api.calls else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agent", default="hr", choices=["hr", "finance", "procurement"])
+    parser.add_argument("--windows", default="0,2,5,10,20", help="comma-separated batch windows in ms (0 = no batching)")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--batch-workers", type=int, default=4)
+    parser.add_argument("--embed-latency-ms", type=float, default=40.0)
+    parser.add_argument("--per-item-ms", type=float, default=0.5)
+    parser.add_argument("--max-inflight", type=int, default=8, help="concurrent embedding calls the API allows")
+    args = parser.parse_args()
+
+    api = FakeEmbeddingAPI(args.embed_latency_ms, args.per_item_ms, args.max_inflight)
+    agent = load_agent(args.agent, api)
+    if agent.CORPUS.index is None:
+        sys.exit("agent index failed to load")
+
+    print(f"{'window_ms':>9} {'req/s':>8} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} {'calls':>6} {'avg_batch':>9}")
+    for window in [float(w) for w in args.windows.split(",")]:
+        r = run(agent, api, window, args)
+        print(f"{r['window_ms']:>9g} {r['throughput']:>8.1f} {r['p50']:>8.1f} {r['p95']:>8.1f} "
+              f"{r['p99']:>8.1f} {r['calls']:>6} {r['avg_batch']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""End-to-end load test of the gateway and the three agents, fully offline.
+
+Starts ``mock_services`` (OpenAI + SAP stand-ins), the HR, Finance and
+Procurement agents and the gateway as local uvicorn processes, drives a mixed
+informational/action workload through ``POST /workflow`` and reports
+throughput, p50/p95/p99 per workload class, requests shed with 429, gateway
+cache hits, the per-stage breakdown taken from the ``Server-Timing`` header and
+LLM calls, tokens, estimated cost and model-cascade escalations.
+
+    python benchmarks/run_benchmark.py --requests 500 --concurrency 32
+    python benchmarks/run_benchmark.py --agent-env QUERY_BATCH_WINDOW_MS=5 --mock-env MOCK_ERROR_RATE=0.01
+
+Extra ``KEY=VALUE`` settings can be passed to every agent, the gateway or the
+mocks, so each performance change can be measured against the baseline.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT, "benchmarks")
+# Agents run from here, as they are deployed, so they can import agent_common
+AGENTS_DIR = os.path.join(ROOT, "src", "agents")
+AGENTS = ["hr", "finance", "procurement"]
+
+WORKLOAD = {
+    ("hr", "information"): [
+        "How many leave days do I get per year?",
+        "What is the remote work policy?",
+        "Tell me about the onboarding steps for new hires",
+    ],
+    ("hr", "action"): [
+        "I want to apply for leave from 2025-09-01 to 2025-09-10",
+        "Please start onboarding for Jane Doe in IT",
+    ],
+    ("finance", "information"): [
+        "What is the invoice approval timeline?",
+        "Explain the expense reimbursement policy",
+        "How often are department budgets reviewed?",
+    ],
+    ("finance", "action"): [
+        "Submit invoice INV-20230815-001 from ACME Supplies for 1250 USD",
+        "Submit invoices INV-1001 from ACME Supplies for 1250 USD\nINV-1002 from Globex for 980.50 EUR\n"
+        "INV-1003 from Initech for 4,300 USD",
+    ],
+    ("procurement", "information"): [
+        "What is the supplier onboarding policy?",
+        "Describe the purchase order approval procedure",
+    ],
+    ("procurement", "action"): [
+        "Place an order for 5 laptops",
+        "I need to purchase an order for 20 monitors",
+        "Place an order for 5 laptops, 10 monitors and 25 keyboards",
+    ],
+}
+
+# Second turns for --session-ratio conversations; they lean on the first turn's context
+FOLLOW_UPS = [
+    "And how long does that take?",
+    "Does it apply to contractors too?",
+    "What about exceptions?",
+]
+
+# USD per million (prompt, completion) tokens, for the cost estimate
+PRICES = {
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+CASCADE_RE = re.compile(r'^agent_cascade_(answers|escalations)_total\{([^}]*)\} ([0-9.e+]+)$', re.MULTILINE)
+
+
+def parse_env(pairs):
+    env = {}
+    for pair in pairs or []:
+        key, _, value = pair.partition("=")
+        env[key] = value
+    return env
+
+
+def parse_server_timing(header):
+    stages = {}
+    for entry in (header or "").split(","):
+        name, _, rest = entry.strip().partition(";dur=")
+        if name and rest:
+            stages[name] = stages.get(name, 0.0) + float(rest)
+    return stages
+
+
+def start(name, cwd, module, port, env, log_dir, extra_args=()):
+    log = open(os.path.join(log_dir, f"{name}.log"), "w")
+    cmd = [sys.executable, "-m", "uvicorn", module, "--host", "127.0.0.1", "--port", str(port), "--no-access-log", *extra_args]
+    return subprocess.Popen(cmd, cwd=cwd, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_healthy(urls, timeout=90):
+    deadline = time.monotonic() + timeout
+    pending = list(urls)
+    while pending and time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{pending[0]}/health", timeout=1).status_code == 200:
+                pending.pop(0)
+                continue
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    if pending:
+        raise RuntimeError(f"services did not become healthy: {pending}")
+
+
+def start_stack(args, log_dir):
+    mock_url = f"http://127.0.0.1:{args.base_port}"
+    gateway_port = args.base_port + 1
+    agent_ports = {
+        agent: [args.base_port + 2 + i * args.replicas + r for r in range(args.replicas)]
+        for i, agent in enumerate(AGENTS)
+    }
+
+    procs = [start("mock", BENCH_DIR, "mock_services:app", args.base_port, parse_env(args.mock_env), log_dir)]
+    wait_healthy([mock_url])
+
+    agent_env = {
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_BASE_URL": f"{mock_url}/v1",
+        "OPENAI_API_BASE": f"{mock_url}/v1",
+        "SAP_TOKEN_URL": f"{mock_url}/oauth/token",
+        "SAP_CLIENT_ID": "benchmark",
+        "SAP_CLIENT_SECRET": "benchmark",
+        "SAP_API_URL": f"{mock_url}/sap/purchase-order",
+        "SAP_API_URL_INVOICE": f"{mock_url}/sap/invoice",
+        "SAP_API_URL_LEAVE": f"{mock_url}/sap/leave",
+        "SAP_API_URL_HR": f"{mock_url}/sap/onboarding",
+        "SAP_BATCH_URL": f"{mock_url}/sap/$batch",
+        **parse_env(args.agent_env),
+    }
+    agent_urls = []
+    for agent, ports in agent_ports.items():
+        for replica, port in enumerate(ports):
+            # Each replica keeps its own SAP action queue, as separate instances would
+            env = {**agent_env, "ACTION_QUEUE_DB": os.path.join(log_dir, f"{agent}_{replica}_queue.db")}
+            procs.append(start(f"{agent}_agent_{replica}", AGENTS_DIR, f"{agent}_agent.main:app", port, env, log_dir))
+            agent_urls.append(f"http://127.0.0.1:{port}")
+
+    gateway_env = {
+        f"{agent.upper()}_AGENT_URLS": ",".join(f"http://127.0.0.1:{port}" for port in ports)
+        for agent, ports in agent_ports.items()
+    }
+    gateway_env.update(parse_env(args.gateway_env))
+    procs.append(start("gateway", os.path.join(ROOT, "src", "api"), "main:app", gateway_port, gateway_env, log_dir))
+
+    wait_healthy(agent_urls + [f"http://127.0.0.1:{gateway_port}"])
+    return procs, {"gateway": f"http://127.0.0.1:{gateway_port}", "mock": mock_url, "agents": agent_urls}
+
+
+def build_requests(args):
+    rng = random.Random(args.seed)
+    info = [key for key in WORKLOAD if key[1] == "information"]
+    action = [key for key in WORKLOAD if key[1] == "action"]
+    plan = []
+    while len(plan) < args.requests:
+        key = rng.choice(action if rng.random() < args.action_ratio else info)
+        priority = "batch" if rng.random() < args.batch_ratio else "interactive"
+        turns, session_id = [rng.choice(WORKLOAD[key])], None
+        if key[1] == "information" and rng.random() < args.session_ratio:
+            turns.append(rng.choice(FOLLOW_UPS))
+            session_id = f"bench-{len(plan)}"
+        plan.append((key, priority, turns, session_id))
+    return plan
+
+
+async def drive(gateway_url, plan, concurrency, timeout):
+    results = []
+    queue = asyncio.Queue()
+    for item in plan:
+        queue.put_nowait(item)
+
+    async def worker(client):
+        while not queue.empty():
+            (domain, intent), priority, turns, session_id = queue.get_nowait()
+            # Turns of one conversation go one after another, like a user reading each answer
+            for turn, task in enumerate(turns):
+                body = {"domain": domain, "task": task, "priority": priority}
+                if session_id:
+                    body["session_id"] = session_id
+                start = time.perf_counter()
+                shed = cached = False
+                try:
+                    resp = await client.post("/workflow", json=body)
+                    shed = resp.status_code == 429
+                    cached = resp.headers.get("X-Cache") == "hit"
+                    # Agents answer a failed task with a 200 whose body has "error", flagged in X-Agent-Error
+                    ok = (resp.status_code < 400 and resp.headers.get("X-Agent-Error") != "true"
+                          and "error" not in resp.json())
+                    stages = parse_server_timing(resp.headers.get("Server-Timing"))
+                except (httpx.HTTPError, ValueError):
+                    ok, stages = False, {}
+                results.append({
+                    "class": f"{domain}/{intent}" + ("/batch" if priority == "batch" else "")
+                             + (f"/session-turn{turn + 1}" if session_id else ""),
+                    "latency": time.perf_counter() - start,
+                    "ok": ok,
+                    "shed": shed,
+                    "cached": cached,
+                    "stages": stages
+                })
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=gateway_url, timeout=timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return results, elapsed
+
+
+def snapshot(urls):
+    """Model usage counted by the mock and cascade counters scraped from every agent"""
+    cascade = defaultdict(float)
+    for url in urls["agents"]:
+        for kind, labels, value in CASCADE_RE.findall(httpx.get(f"{url}/metrics").text):
+            cascade[f"{kind}:{labels}"] += float(value)
+    return {"mock": httpx.get(f"{urls['mock']}/stats").json(), "cascade": cascade}
+
+
+def usage_delta(before, after):
+    models = {}
+    for key, value in after["mock"].items():
+        kind, _, model = key.partition(":")
+        if model and kind in ("chat_calls", "prompt_tokens", "completion_tokens"):
+            models.setdefault(model, {"chat_calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+            models[model][kind] = value - before["mock"].get(key, 0)
+    for model, row in models.items():
+        prompt_price, completion_price = PRICES.get(model, (0.0, 0.0))
+        row["cost_usd"] = (row["prompt_tokens"] * prompt_price + row["completion_tokens"] * completion_price) / 1e6
+    cascade = {
+        key: value - before["cascade"].get(key, 0.0)
+        for key, value in after["cascade"].items() if value - before["cascade"].get(key, 0.0)
+    }
+    return {"models": models, "cascade": cascade}
+
+
+def summarize(results, elapsed):
+    def pct(values):
+        ms = np.array(values) * 1000
+        return {"p50": float(np.percentile(ms, 50)), "p95": float(np.percentile(ms, 95)), "p99": float(np.percentile(ms, 99))}
+
+    by_class = defaultdict(list)
+    for r in results:
+        by_class[r["class"]].append(r)
+    classes = {}
+    for name, rows in sorted(by_class.items()):
+        served = [r["latency"] for r in rows if not r["shed"]] or [0.0]
+        classes[name] = {
+            "count": len(rows),
+            "errors": sum(not r["ok"] and not r["shed"] for r in rows),
+            "shed": sum(r["shed"] for r in rows),
+            **pct(served)
+        }
+
+    stage_samples = defaultdict(list)
+    for r in results:
+        if r["ok"]:
+            for stage, ms in r["stages"].items():
+                stage_samples[stage].append(ms)
+    stages = {
+        stage: {"count": len(v), "mean": float(np.mean(v)), "p95": float(np.percentile(v, 95))}
+        for stage, v in sorted(stage_samples.items())
+    }
+    return {
+        "requests": len(results),
+        "errors": sum(not r["ok"] and not r["shed"] for r in results),
+        "shed": sum(r["shed"] for r in results),
+        "cache_hits": sum(r["cached"] for r in results),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(results) / elapsed if elapsed else 0.0,
+        "overall": pct([r["latency"] for r in results if not r["shed"]] or [0.0]),
+        "classes": classes,
+        "stages_ms": stages
+    }
+
+
+def print_report(report):
+    print(f"\nrequests={report['requests']} errors={report['errors']} shed={report['shed']} "
+          f"cache_hits={report['cache_hits']} "
+          f"elapsed={report['elapsed_s']:.1f}s throughput={report['throughput_rps']:.1f} req/s")
+    overall = {"count": report["requests"], "errors": report["errors"], "shed": report["shed"], **report["overall"]}
+    print(f"\n{'class':<30} {'count':>6} {'errors':>6} {'shed':>6} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9}")
+    for name, row in [("overall", overall)] + list(report["classes"].items()):
+        print(f"{name:<30} {row['count']:>6} {row['errors']:>6} {row['shed']:>6} "
+              f"{row['p50']:>9.1f} {row['p95']:>9.1f} {row['p99']:>9.1f}")
+    print(f"\n{'stage':<30} {'count':>6} {'mean_ms':>9} {'p95_ms':>9}")
+    for stage, row in report["stages_ms"].items():
+        print(f"{stage:<30} {row['count']:>6} {row['mean']:>9.1f} {row['p95']:>9.1f}")
+    usage = report.get("usage")
+    if not usage:
+        return
+    print(f"\n{'model':<30} {'calls':>6} {'prompt_tok':>11} {'compl_tok':>10} {'cost_usd':>9}")
+    for model, row in sorted(usage["models"].items()):
+        print(f"{model:<30} {row['chat_calls']:>6} {row['prompt_tokens']:>11} {row['completion_tokens']:>10} "
+              f"{row['cost_usd']:>9.4f}")
+    total_cost = sum(row["cost_usd"] for row in usage["models"].values())
+    print(f"estimated LLM cost per 1k requests: ${total_cost / report['requests'] * 1000:.4f}")
+    answers = {key.split('"')[1]: value for key, value in usage["cascade"].items() if key.startswith("answers:")}
+    if answers:
+        total = sum(answers.values())
+        print("\nanswers by tier: " + ", ".join(f"{tier}={int(n)}" for tier, n in sorted(answers.items())))
+        print(f"escalated to the strong model: {answers.get('strong', 0) / total:.0%} of {int(total)} answers")
+        for key, value in sorted(usage["cascade"].items()):
+            if key.startswith("escalations:"):
+                print(f"  {key.removeprefix('escalations:')}: {int(value)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=20, help="requests sent before measuring")
+    parser.add_argument("--action-ratio", type=float, default=0.2, help="fraction of action (SAP) requests")
+    parser.add_argument("--batch-ratio", type=float, default=0.0, help="fraction of requests sent with batch priority")
+    parser.add_argument("--session-ratio", type=float, default=0.0,
+                        help="fraction of informational requests that become two-turn conversations")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--base-port", type=int, default=18990)
+    parser.add_argument("--replicas", type=int, default=1, help="instances of each agent behind the gateway")
+    parser.add_argument("--agent-env", action="append", metavar="KEY=VALUE", help="extra env for every agent")
+    parser.add_argument("--gateway-env", action="append", metavar="KEY=VALUE", help="extra env for the gateway")
+    parser.add_argument("--mock-env", action="append", metavar="KEY=VALUE", help="latency/error settings for the mocks")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    log_dir = tempfile.mkdtemp(prefix="sap-bench-")
+    print(f"service logs: {log_dir}")
+    procs, urls = start_stack(args, log_dir)
+    try:
+        plan = build_requests(args)
+        if args.warmup:
+            asyncio.run(drive(urls["gateway"], plan[:args.warmup], args.concurrency, args.timeout))
+        before = snapshot(urls)
+        results, elapsed = asyncio.run(drive(urls["gateway"], plan, args.concurrency, args.timeout))
+        report = summarize(results, elapsed)
+        report["usage"] = usage_delta(before, snapshot(urls))
+        print_report(report)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
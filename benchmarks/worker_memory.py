@@ -0,0 +1,132 @@
+"""Memory and startup cost of running one agent with several uvicorn workers.
+
+Starts the OpenAI stand-in and the agent with ``--workers N`` twice, once with
+every worker building its own in-memory index and once with ``INDEX_MMAP=true``
+(one shared, memory-mapped artifact). For each run it reports RSS and PSS per
+worker (PSS splits shared pages between the processes that map them), the
+startup time and how many texts were sent to the embeddings endpoint.
+
+The shipped corpora are a few dozen lines, so the agent (with the shared
+agent_common package) is copied to a temporary directory with a synthetic
+corpus of ``--corpus-lines`` documents.
+
+    python benchmarks/worker_memory.py --agent hr --workers 4 --corpus-lines 5000
+
+Linux only (reads /proc).
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import httpx
+
+from run_benchmark import AGENTS_DIR, BENCH_DIR, start, wait_healthy
+
+
+def worker_pids(parent_pid):
+    """uvicorn worker processes, leaving out multiprocessing's resource tracker"""
+    pids = []
+    with open(f"/proc/{parent_pid}/task/{parent_pid}/children") as f:
+        for pid in f.read().split():
+            with open(f"/proc/{pid}/cmdline", "rb") as cmdline:
+                if b"resource_tracker" not in cmdline.read():
+                    pids.append(int(pid))
+    return pids
+
+
+def memory_kb(pid):
+    usage = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss"):
+                usage[key] = int(value.split()[0])
+    return usage
+
+
+def make_agent_copy(agent, corpus_lines, work_dir):
+    """Copy the agent with a corpus of corpus_lines documents built from its real ones"""
+    ignore = shutil.ignore_patterns("__pycache__", "index", "*.db*")
+    shutil.copytree(os.path.join(AGENTS_DIR, "agent_common"), os.path.join(work_dir, "agent_common"), ignore=ignore)
+    dst = os.path.join(work_dir, f"{agent}_agent")
+    shutil.copytree(os.path.join(AGENTS_DIR, f"{agent}_agent"), dst, ignore=ignore)
+    docs_path = os.path.join(dst, f"{agent}_docs.txt")
+    with open(docs_path) as f:
+        docs = [line.strip() for line in f if line.strip()]
+    with open(docs_path, "w") as f:
+        for i in range(corpus_lines):
+            f.write(f"{docs[i % len(docs)]} (section {i})\n")
+    return dst
+
+
+def measure(args, agent_dir, mmap_mode, mock_url, log_dir):
+    port = args.base_port + 1
+    env = {
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_BASE_URL": f"{mock_url}/v1",
+        "OPENAI_API_BASE": f"{mock_url}/v1",
+        "INDEX_MMAP": "true" if mmap_mode else "false",
+        "INDEX_DIR": os.path.join(log_dir, "index"),
+        "LOG_LEVEL": "WARNING",
+    }
+    before = httpx.get(f"{mock_url}/stats").json().get("embedded_texts", 0)
+    started = time.perf_counter()
+    name = f"agent_{'mmap' if mmap_mode else 'private'}"
+    proc = start(
+        name, os.path.dirname(agent_dir), f"{args.agent}_agent.main:app", port, env, log_dir,
+        extra_args=["--workers", str(args.workers)]
+    )
+    try:
+        wait_healthy([f"http://127.0.0.1:{port}"], timeout=600)
+        # /health answers as soon as one worker is up; wait for every worker to finish loading
+        while len(worker_pids(proc.pid)) < args.workers:
+            time.sleep(0.2)
+        for _ in range(args.workers * 4):
+            if httpx.get(f"http://127.0.0.1:{port}/debug", timeout=30).json()["index_status"] != "LOADED":
+                raise RuntimeError(f"index not loaded, see {log_dir}/{name}.log")
+        startup = time.perf_counter() - started
+        embedded = httpx.get(f"{mock_url}/stats").json().get("embedded_texts", 0) - before
+        workers = [memory_kb(pid) for pid in worker_pids(proc.pid)]
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+    return {"mode": "mmap" if mmap_mode else "private", "startup_s": startup, "embedded": embedded, "workers": workers}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agent", default="hr", choices=["hr", "finance", "procurement"])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--corpus-lines", type=int, default=5000)
+    parser.add_argument("--base-port", type=int, default=18990)
+    args = parser.parse_args()
+    if not sys.platform.startswith("linux"):
+        sys.exit("worker_memory.py reads /proc and only runs on Linux")
+
+    work_dir = tempfile.mkdtemp(prefix="sap-workers-")
+    print(f"service logs: {work_dir}")
+    mock_url = f"http://127.0.0.1:{args.base_port}"
+    mock = start("mock", BENCH_DIR, "mock_services:app", args.base_port, {"MOCK_EMBED_ITEM_MS": "0"}, work_dir)
+    try:
+        wait_healthy([mock_url])
+        agent_dir = make_agent_copy(args.agent, args.corpus_lines, work_dir)
+        runs = [measure(args, agent_dir, mmap_mode, mock_url, work_dir) for mmap_mode in (False, True)]
+    finally:
+        mock.terminate()
+        mock.wait(timeout=10)
+
+    print(f"\n{'mode':<8} {'worker':>6} {'rss_mb':>8} {'pss_mb':>8}")
+    for run in runs:
+        for i, usage in enumerate(run["workers"]):
+            print(f"{run['mode']:<8} {i:>6} {usage['Rss'] / 1024:>8.1f} {usage['Pss'] / 1024:>8.1f}")
+    print(f"\n{'mode':<8} {'total_pss_mb':>12} {'startup_s':>10} {'texts_embedded':>15}")
+    for run in runs:
+        total = sum(usage["Pss"] for usage in run["workers"]) / 1024
+        print(f"{run['mode']:<8} {total:>12.1f} {run['startup_s']:>10.1f} {run['embedded']:>15}")
+
+
+if __name__ == "__main__":
+    main()
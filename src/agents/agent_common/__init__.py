@@ -0,0 +1,5 @@
+"""Infrastructure shared by the HR, Finance and Procurement agents.
+
+Each agent's Cloud Foundry app is pushed from src/agents (see the agent's
+manifest.yml), so this package is deployed alongside every agent.
+"""
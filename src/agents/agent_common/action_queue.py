@@ -0,0 +1,246 @@
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from fastapi.responses import ORJSONResponse
+
+from agent_common.metrics import ACTION_JOBS
+from agent_common.sap import SAP_BATCH_SIZE, SAP_BATCH_URL, SAP_TIMEOUT_S, chunked, post_to_sap, submit_sap_batch
+
+# -------------------------------------------------
+# Durable SAP action queue (SQLite)
+# -------------------------------------------------
+ACTION_QUEUE_MODE = os.getenv("ACTION_QUEUE_MODE", "false").lower() == "true"
+# Relative to the working directory: the app root on Cloud Foundry, where each agent has its own container
+ACTION_QUEUE_DB = os.getenv("ACTION_QUEUE_DB", "action_queue.db")
+ACTION_QUEUE_WORKERS = int(os.getenv("ACTION_QUEUE_WORKERS", "4"))
+ACTION_QUEUE_MAX_ATTEMPTS = int(os.getenv("ACTION_QUEUE_MAX_ATTEMPTS", "5"))
+ACTION_QUEUE_RETRY_BASE_S = float(os.getenv("ACTION_QUEUE_RETRY_BASE_S", "2"))
+ACTION_QUEUE_LEASE_S = float(os.getenv("ACTION_QUEUE_LEASE_S", "120"))
+if ACTION_QUEUE_LEASE_S <= 2 * SAP_TIMEOUT_S:
+    # A token request plus the SAP call must fit in the lease, or a second worker re-sends the job
+    logging.warning(
+        "ACTION_QUEUE_LEASE_S=%s does not cover two SAP_TIMEOUT_S=%s calls; using %s",
+        ACTION_QUEUE_LEASE_S, SAP_TIMEOUT_S, 2 * SAP_TIMEOUT_S + 10
+    )
+    ACTION_QUEUE_LEASE_S = 2 * SAP_TIMEOUT_S + 10
+
+JOB_AVAILABLE = threading.Event()
+QUEUE_DB = threading.local()
+
+def queue_db():
+    """One SQLite connection per thread; WAL lets workers and request threads share the file"""
+    conn = getattr(QUEUE_DB, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(ACTION_QUEUE_DB, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                idempotency_key TEXT NOT NULL,
+                action TEXT NOT NULL,
+                url TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                sap_status TEXT,
+                sap_result TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                UNIQUE (action, idempotency_key)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, next_attempt_at)")
+        QUEUE_DB.conn = conn
+    return conn
+
+def enqueue_sap_action(domain, action, url, payload, context_answer, sources, idempotency_key=None, extra=None):
+    """Persist an SAP submission and answer 202 with a job ID instead of waiting for SAP.
+
+    An Idempotency-Key is scoped to the action: a replay returns the existing job, while
+    reusing the key for a different payload is rejected with 422. status_url is the
+    gateway's job route for the agent's domain, which finds the replica holding the job.
+    """
+    now = time.time()
+    idempotency_key = idempotency_key or uuid.uuid4().hex
+    conn = queue_db()
+    conn.execute(
+        "INSERT OR IGNORE INTO jobs (id, idempotency_key, action, url, payload, status, next_attempt_at, created_at, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+        (uuid.uuid4().hex, idempotency_key, action, url, json.dumps(payload), now, now, now)
+    )
+    job = conn.execute(
+        "SELECT id, status, payload FROM jobs WHERE action = ? AND idempotency_key = ?", (action, idempotency_key)
+    ).fetchone()
+    if json.loads(job["payload"]) != payload:
+        logging.warning("Idempotency-Key reused for a different %s request (job %s)", action, job["id"])
+        return ORJSONResponse(status_code=422, content={
+            "detail": f"Idempotency-Key was already used for a different {action} request",
+            "job_id": job["id"]
+        })
+    JOB_AVAILABLE.set()
+    logging.info("Queued %s job %s", action, job["id"])
+    return ORJSONResponse(status_code=202, content={
+        "result": context_answer,
+        **sources,
+        "action_performed": f"{action}_queued",
+        "job_id": job["id"],
+        "job_status": job["status"],
+        "status_url": f"/workflow/{domain}/jobs/{job['id']}",
+        **(extra or {})
+    })
+
+def claim_job():
+    """Atomically take the next due job (or one whose lease expired) and extend its lease"""
+    conn = queue_db()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        job = conn.execute(
+            "SELECT * FROM jobs WHERE status IN ('queued', 'running') AND next_attempt_at <= ? "
+            "ORDER BY next_attempt_at LIMIT 1", (now,)
+        ).fetchone()
+        if job is not None:
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, next_attempt_at = ?, updated_at = ? WHERE id = ?",
+                (now + ACTION_QUEUE_LEASE_S, now, job["id"])
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return job
+
+def finish_job(job, status, sap_status, sap_result, next_attempt_at=None):
+    queue_db().execute(
+        "UPDATE jobs SET status = ?, sap_status = ?, sap_result = ?, next_attempt_at = ?, updated_at = ? WHERE id = ?",
+        (status, str(sap_status), json.dumps(sap_result), next_attempt_at or time.time(), time.time(), job["id"])
+    )
+
+def run_job(job):
+    attempts = job["attempts"] + 1
+    if job["action"].startswith("bulk_"):
+        sap_status, sap_result, retryable = run_bulk_job(job)
+    else:
+        try:
+            sap_status, sap_result = post_to_sap(job["url"], json.loads(job["payload"]), job["idempotency_key"])
+            retryable = sap_status == 429 or sap_status >= 500
+        except Exception as e:
+            sap_status, sap_result, retryable = "ERROR", str(e), True
+
+    if not retryable:
+        outcome = "succeeded" if sap_status < 400 else "failed"
+        finish_job(job, outcome, sap_status, sap_result)
+    elif attempts >= ACTION_QUEUE_MAX_ATTEMPTS:
+        outcome = "failed"
+        finish_job(job, outcome, sap_status, sap_result)
+    else:
+        outcome = "retrying"
+        delay = ACTION_QUEUE_RETRY_BASE_S * 2 ** (attempts - 1) * random.uniform(0.8, 1.2)
+        finish_job(job, "queued", sap_status, sap_result, time.time() + delay)
+    ACTION_JOBS.labels(job["action"], outcome).inc()
+    logging.info("SAP %s job %s attempt %d: %s (%s)", job["action"], job["id"], attempts, outcome, sap_status)
+
+def action_worker():
+    while True:
+        try:
+            job = claim_job()
+        except Exception as e:
+            logging.error("Action queue error: %s", e)
+            job = None
+        if job is None:
+            JOB_AVAILABLE.wait(timeout=1.0)
+            JOB_AVAILABLE.clear()
+            continue
+        try:
+            run_job(job)
+        except Exception as e:
+            # e.g. "database is locked" while recording the result; the job is picked up again when its lease expires
+            logging.error("Action job %s failed: %s", job["id"], e)
+
+def get_job(job_id):
+    job = queue_db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if job is None:
+        return None
+    return {
+        "job_id": job["id"],
+        "action": job["action"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "sap_api_status": int(job["sap_status"]) if (job["sap_status"] or "").isdigit() else job["sap_status"],
+        "sap_api_result": json.loads(job["sap_result"]) if job["sap_result"] else None,
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"]
+    }
+
+if ACTION_QUEUE_MODE:
+    for _ in range(ACTION_QUEUE_WORKERS):
+        threading.Thread(target=action_worker, daemon=True).start()
+
+# -------------------------------------------------
+# Bulk submissions: one $batch run, direct or queued
+# -------------------------------------------------
+def retryable_status(status):
+    return not isinstance(status, int) or status == 429 or status >= 500
+
+def run_bulk_job(job):
+    """One attempt at a queued $batch run; returns (sap_status, item results, retryable).
+
+    Results are saved after every $batch request, together with a renewed lease, so a retry
+    or a worker taking over an expired lease only sends the items that have not succeeded.
+    """
+    payload = json.loads(job["payload"])
+    items = payload["items"]
+    results = json.loads(job["sap_result"]) if job["sap_result"] else [None] * len(items)
+    pending = [
+        i for i, result in enumerate(results)
+        if result is None or (not result["succeeded"] and retryable_status(result["sap_api_status"]))
+    ]
+    for chunk in chunked(pending, SAP_BATCH_SIZE):
+        try:
+            chunk_results = submit_sap_batch(payload["entity_set"], [items[i] for i in chunk])
+        except Exception as e:
+            logging.error("SAP bulk job %s failed: %s", job["id"], e)
+            chunk_results = [
+                {"item": items[i], "sap_api_status": "ERROR", "sap_api_result": str(e), "succeeded": False}
+                for i in chunk
+            ]
+        for i, result in zip(chunk, chunk_results):
+            results[i] = result
+        now = time.time()
+        queue_db().execute(
+            "UPDATE jobs SET sap_result = ?, next_attempt_at = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(results), now + ACTION_QUEUE_LEASE_S, now, job["id"])
+        )
+    failed = [result["sap_api_status"] for result in results if not result["succeeded"]]
+    return (failed[0] if failed else 200), results, any(retryable_status(status) for status in failed)
+
+def bulk_response(domain, context_answer, sources, action, entity_set, items, idempotency_key=None):
+    """Submit items to entity_set as one $batch run, or queue the run in ACTION_QUEUE_MODE"""
+    if ACTION_QUEUE_MODE:
+        return enqueue_sap_action(
+            domain, f"bulk_{action}", SAP_BATCH_URL, {"entity_set": entity_set, "items": items}, context_answer, sources,
+            idempotency_key, extra={"items_queued": len(items)}
+        )
+    try:
+        results = submit_sap_batch(entity_set, items)
+    except Exception as e:
+        logging.error("SAP bulk %s failed: %s", action, e)
+        results = [{"item": item, "sap_api_status": "ERROR", "sap_api_result": str(e), "succeeded": False} for item in items]
+    succeeded = sum(r["succeeded"] for r in results)
+    return {
+        "result": context_answer,
+        **sources,
+        "action_performed": f"bulk_{action}_submitted" if succeeded else f"bulk_{action}_failed",
+        "items_submitted": len(results),
+        "items_succeeded": succeeded,
+        "items_failed": len(results) - succeeded,
+        "item_results": results
+    }
@@ -0,0 +1,130 @@
+import logging
+import os
+import re
+
+from dotenv import load_dotenv
+from langchain_community.chat_models import ChatOpenAI
+
+from agent_common.logs import log_payload
+from agent_common.metrics import CASCADE_ANSWERS, CASCADE_ESCALATIONS, LLM_TOKENS, timed
+from agent_common.tracing import trace_headers, traced
+
+# -------------------------------------------------
+# Load environment variables and LLM
+# -------------------------------------------------
+load_dotenv()
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+# Cheaper tiers tried before LLM_MODEL, in order: "extractive" (top document), "fast" (capped fast model)
+CASCADE_TIERS = [tier.strip() for tier in os.getenv("CASCADE_TIERS", "").split(",") if tier.strip()]
+CASCADE_FAST_MODEL = os.getenv("CASCADE_FAST_MODEL", "gpt-4o-mini")
+CASCADE_FAST_MAX_TOKENS = int(os.getenv("CASCADE_FAST_MAX_TOKENS", "256"))
+CASCADE_MIN_GROUNDEDNESS = float(os.getenv("CASCADE_MIN_GROUNDEDNESS", "0.6"))
+CASCADE_MIN_QUERY_OVERLAP = float(os.getenv("CASCADE_MIN_QUERY_OVERLAP", "0.6"))
+
+llm = ChatOpenAI(
+    model=LLM_MODEL,
+    openai_api_key=os.getenv("OPENAI_API_KEY")
+)
+fast_llm = ChatOpenAI(
+    model=CASCADE_FAST_MODEL,
+    max_tokens=CASCADE_FAST_MAX_TOKENS,
+    openai_api_key=os.getenv("OPENAI_API_KEY")
+) if "fast" in CASCADE_TIERS else None
+
+def record_llm_usage(response):
+    """Count prompt/completion tokens reported by the LLM"""
+    metadata = getattr(response, "response_metadata", None) or {}
+    usage = metadata.get("token_usage") or {}
+    model = metadata.get("model_name", "unknown")
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind):
+            LLM_TOKENS.labels(model, kind.split("_")[0]).inc(usage[kind])
+
+STOPWORDS = frozenset(
+    "the and for are was were with from that this what how does can you your our any all not but has have "
+    "will about into per when which who their there".split()
+)
+REFUSAL_RE = re.compile(
+    r"\b(not (in|mentioned|found|covered|provided|available)|no (relevant )?information|"
+    r"(don't|do not) (know|mention|contain|cover)|cannot (find|answer|determine))\b",
+    re.IGNORECASE
+)
+
+def content_words(text):
+    return {word for word in re.findall(r"[a-z0-9]+", text.lower()) if len(word) > 2 and word not in STOPWORDS}
+
+def groundedness(answer, context):
+    """Share of the answer's content words that also appear in the retrieved documents"""
+    words = content_words(answer)
+    return len(words & content_words(context)) / len(words) if words else 0.0
+
+def extractive_tier(query, context_docs, messages):
+    """The top document itself, when it contains enough of the question's key words"""
+    if not context_docs:
+        return None, "no_docs"
+    query_words = content_words(query)
+    overlap = len(query_words & content_words(context_docs[0])) / len(query_words) if query_words else 0.0
+    if overlap < CASCADE_MIN_QUERY_OVERLAP:
+        return None, "low_overlap"
+    return context_docs[0], None
+
+def fast_tier(query, context_docs, messages):
+    """The fast model with a max_tokens cap; escalate if it was cut off, declined or strayed from the documents"""
+    try:
+        with timed("generate_fast"):
+            response = fast_llm.invoke(messages, extra_headers=trace_headers())
+    except Exception as e:
+        logging.warning("Fast model failed, escalating: %s", e)
+        return None, "error"
+    record_llm_usage(response)
+    if (response.response_metadata or {}).get("finish_reason") == "length":
+        return None, "truncated"
+    if REFUSAL_RE.search(response.content):
+        return None, "refused"
+    if groundedness(response.content, "\n".join(context_docs)) < CASCADE_MIN_GROUNDEDNESS:
+        return None, "ungrounded"
+    return response.content, None
+
+CASCADE_STEPS = {"extractive": extractive_tier, "fast": fast_tier}
+for tier in [tier for tier in CASCADE_TIERS if tier not in CASCADE_STEPS]:
+    logging.error("Ignoring unknown CASCADE_TIERS entry %r", tier)
+    CASCADE_TIERS.remove(tier)
+
+@traced("generate_answer")
+def generate_answer(prompt, query, context_docs, history=""):
+    """Generate answer with the agent's prompt, using retrieved documents (and the session's recent turns) as context.
+
+    A failed model call raises: the task then reports an error, which the gateway counts
+    against the agent and does not cache, instead of a placeholder answer.
+    """
+    if not context_docs:
+        context = "No relevant company documents found."
+    else:
+        context = "\n\n".join(context_docs)
+
+    # Debug logging
+    log_payload("prompt", "Context being sent to LLM: %.300s...", context)
+
+    messages = prompt.format_messages(
+        question=query,
+        context=context,
+        history=f"Conversation so far:\n{history}\n\n" if history else ""
+    )
+    for tier in CASCADE_TIERS:
+        answer, reason = CASCADE_STEPS[tier](query, context_docs, messages)
+        if answer is not None:
+            CASCADE_ANSWERS.labels(tier).inc()
+            log_payload("llm_response", "%s answer: %.200s...", tier, answer)
+            return answer
+        CASCADE_ESCALATIONS.labels(tier, reason).inc()
+
+    with timed("generate"):
+        response = llm.invoke(messages, extra_headers=trace_headers())
+    record_llm_usage(response)
+    CASCADE_ANSWERS.labels("strong").inc()
+
+    # Debug logging
+    log_payload("llm_response", "LLM response: %.200s...", response.content)
+
+    return response.content
@@ -0,0 +1,99 @@
+import atexit
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import re
+from logging.handlers import QueueHandler, QueueListener
+
+from agent_common.tracing import CURRENT_SPAN
+
+# -------------------------------------------------
+# Configure logging
+# -------------------------------------------------
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_REDACT_PII = os.getenv("LOG_REDACT_PII", "true").lower() == "true"
+LOG_PAYLOAD_SAMPLE_RATIO = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATIO", "0.1"))
+
+class TraceContextFilter(logging.Filter):
+    """Stamp each log record with the current trace ID"""
+    def filter(self, record):
+        current = CURRENT_SPAN.get()
+        record.trace_id = current.trace_id if current else "-"
+        return True
+
+PII_PATTERNS = [
+    (re.compile(r"""(['"]?employee_?name['"]?\s*[:=]\s*['"]?)[^'",}]+""", re.IGNORECASE), r"\1[REDACTED]"),
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "[EMAIL]"),
+    (re.compile(r"\b(for|employee|named|name is)\s+[A-Z][a-z]+(?:\s+[A-Z][a-z]+)+"), r"\1 [NAME]"),
+]
+
+def redact(text):
+    for pattern, replacement in PII_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+class StructuredFormatter(logging.Formatter):
+    """Text or JSON log lines with PII redacted; runs on the listener thread, not the request"""
+    def __init__(self, as_json):
+        super().__init__(
+            "%(asctime)s [%(levelname)s] [trace=%(trace_id)s] %(message)s",
+            defaults={"trace_id": "-"}
+        )
+        self.as_json = as_json
+
+    def format(self, record):
+        message = record.getMessage()
+        record.msg, record.args = (redact(message) if LOG_REDACT_PII else message), None
+        if not self.as_json:
+            return super().format(record)
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "trace_id": getattr(record, "trace_id", "-"),
+            "msg": record.msg
+        }
+        if getattr(record, "category", None):
+            entry["category"] = record.category
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+class DroppingQueueHandler(QueueHandler):
+    """Hand records to the listener thread unformatted; drop them if the log drain falls behind"""
+    dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+LOG_QUEUE = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+LOG_STREAM_HANDLER = logging.StreamHandler()
+LOG_STREAM_HANDLER.setFormatter(StructuredFormatter(LOG_FORMAT == "json"))
+LOG_QUEUE_HANDLER = DroppingQueueHandler(LOG_QUEUE)
+LOG_QUEUE_HANDLER.addFilter(TraceContextFilter())
+logging.basicConfig(level=LOG_LEVEL, handlers=[LOG_QUEUE_HANDLER])
+LOG_LISTENER = QueueListener(LOG_QUEUE, LOG_STREAM_HANDLER)
+LOG_LISTENER.start()
+atexit.register(LOG_LISTENER.stop)
+
+@functools.lru_cache(maxsize=None)
+def payload_sample_ratio(category):
+    return float(os.getenv(f"LOG_SAMPLE_{category.upper()}", LOG_PAYLOAD_SAMPLE_RATIO))
+
+def log_payload(category, msg, *args):
+    """Log a verbose debug payload (task text, documents, prompts), sampled per category"""
+    if not logging.getLogger().isEnabledFor(logging.DEBUG):
+        return
+    if random.random() < payload_sample_ratio(category):
+        logging.debug(msg, *args, extra={"category": category})
@@ -0,0 +1,50 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+# -------------------------------------------------
+# Metrics (Prometheus) and Server-Timing
+# -------------------------------------------------
+STAGE_LATENCY = Histogram(
+    "agent_stage_seconds", "Latency of each request stage", ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+REQUESTS_IN_FLIGHT = Gauge("agent_requests_in_flight", "Requests currently being processed")
+CACHE_REQUESTS = Counter("agent_cache_requests_total", "Cache lookups by cache and result", ["cache", "result"])
+LLM_TOKENS = Counter("agent_llm_tokens_total", "LLM tokens consumed", ["model", "kind"])
+CASCADE_ANSWERS = Counter("agent_cascade_answers_total", "Answers by the cascade tier that produced them", ["tier"])
+CASCADE_ESCALATIONS = Counter(
+    "agent_cascade_escalations_total", "Answers passed on to the next tier, by reason", ["tier", "reason"]
+)
+ACTION_JOBS = Counter("agent_action_jobs_total", "SAP action jobs by outcome", ["action", "outcome"])
+
+SERVER_TIMING = contextvars.ContextVar("server_timing", default=None)
+
+@contextmanager
+def timed(stage):
+    """Record a stage in the latency histogram and the request's Server-Timing header"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.labels(stage).observe(elapsed)
+        timings = SERVER_TIMING.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+def format_server_timing(timings):
+    return ", ".join(f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in timings)
+
+def metrics_response():
+    """Prometheus text format"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Several uvicorn workers: aggregate what each process wrote to the shared directory
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
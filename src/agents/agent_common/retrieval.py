@@ -0,0 +1,229 @@
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import faiss
+import numpy as np
+from openai import OpenAI
+
+from agent_common.logs import log_payload
+from agent_common.metrics import timed
+from agent_common.tracing import trace_headers, traced
+
+# -------------------------------------------------
+# OpenAI Embedding Function (replacing HuggingFace)
+# -------------------------------------------------
+def get_openai_embedding(texts):
+    """Use OpenAI embeddings instead of HuggingFace"""
+    try:
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+        if isinstance(texts, str):
+            texts = [texts]
+
+        response = client.embeddings.create(
+            input=texts,
+            model="text-embedding-ada-002",
+            extra_headers=trace_headers()
+        )
+
+        embeddings = [item.embedding for item in response.data]
+        return np.array(embeddings)
+
+    except Exception as e:
+        logging.error("OpenAI embedding error: %s", e)
+        raise
+
+# -------------------------------------------------
+# Shared index artifact for multi-worker deployments
+# -------------------------------------------------
+INDEX_MMAP = os.getenv("INDEX_MMAP", "false").lower() == "true"
+INDEX_DIR = os.getenv("INDEX_DIR", "")  # defaults to index/ next to the agent's documents
+
+class MappedDocs:
+    """Read-only document list backed by an mmap'd file, so every worker shares the same pages"""
+
+    def __init__(self, path):
+        with open(path + ".docs", "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = np.load(path + ".offsets.npy", mmap_mode="r")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode("utf-8")
+
+def write_index_artifact(path, docs, embeddings):
+    """Write under temporary names and rename, the index last, so readers never see a partial artifact"""
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(embeddings)
+    faiss.write_index(index, path + ".faiss.tmp")
+    encoded = [doc.encode("utf-8") for doc in docs]
+    with open(path + ".docs.tmp", "wb") as f:
+        f.write(b"".join(encoded))
+    with open(path + ".offsets.npy.tmp", "wb") as f:
+        np.save(f, np.cumsum([0] + [len(doc) for doc in encoded], dtype=np.int64))
+    for suffix in (".docs", ".offsets.npy", ".faiss"):
+        os.replace(path + suffix + ".tmp", path + suffix)
+
+def load_shared_index(index_dir, name, docs, version):
+    """Build the artifact for this corpus version once (the first worker to get the lock), then mmap it"""
+    os.makedirs(index_dir, exist_ok=True)
+    path = os.path.join(index_dir, f"{name}-{version}")
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(path + ".faiss"):
+            logging.info("Building shared index artifact %s", path)
+            write_index_artifact(path, docs, get_openai_embedding(docs))
+    # IO_FLAG_MMAP_IFC maps flat indexes in place; plain IO_FLAG_MMAP would copy their vectors into memory
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    return faiss.read_index(path + ".faiss", flags), MappedDocs(path)
+
+# -------------------------------------------------
+# Query micro-batching (embedding + FAISS search)
+# -------------------------------------------------
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "0"))
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+QUERY_BATCH_WORKERS = int(os.getenv("QUERY_BATCH_WORKERS", "4"))
+
+class QueryBatcher:
+    """Collect concurrent search queries and run them as one embedding call and one FAISS search"""
+
+    def __init__(self, index, window_ms, max_size, workers):
+        self.index = index
+        self.window = window_ms / 1000.0
+        self.max_size = max(1, max_size)
+        self.pending = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        threading.Thread(target=self._collect, daemon=True).start()
+
+    def search(self, query, top_k):
+        """Block until the batch containing this query has been searched"""
+        future = Future()
+        self.pending.put((query, top_k, future))
+        return future.result()
+
+    def _collect(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.executor.submit(self._flush, batch)
+
+    def _flush(self, batch):
+        try:
+            with timed("embed"):
+                q_emb = get_openai_embedding([query for query, _, _ in batch])
+            with timed("search"):
+                D, I = self.index.search(q_emb, max(top_k for _, top_k, _ in batch))
+            for row, (_, top_k, future) in enumerate(batch):
+                future.set_result((D[row][:top_k], I[row][:top_k], q_emb[row]))
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+
+# -------------------------------------------------
+# Reference documents, their index and search
+# -------------------------------------------------
+class Corpus:
+    """An agent's reference documents (one per non-empty line of doc_path) and their FAISS index"""
+
+    def __init__(self, name, label, doc_path):
+        self.name = name  # prefix of the shared index artifact
+        self.label = label  # "HR", "Finance", ... in log messages
+        self.doc_path = doc_path
+        try:
+            with open(doc_path, "r") as f:
+                self.docs = [line.strip() for line in f if line.strip()]
+            # Changes whenever the documents do; the gateway keys its response cache on it
+            self.version = hashlib.sha256("\n".join(self.docs).encode()).hexdigest()[:16]
+
+            logging.info("Loaded %d %s document lines from %s", len(self.docs), label, doc_path)
+            log_payload("docs", "First document: %.100s", self.docs[0] if self.docs else "NONE")
+
+            if INDEX_MMAP:
+                index_dir = INDEX_DIR or os.path.join(os.path.dirname(doc_path), "index")
+                self.index, self.docs = load_shared_index(index_dir, name, self.docs, self.version)
+                self.offsets = self.docs.offsets
+                logging.info("Opened memory-mapped index for corpus version %s", self.version)
+            else:
+                embeddings = get_openai_embedding(self.docs)
+                self.index = faiss.IndexFlatL2(embeddings.shape[1])
+                self.index.add(embeddings)
+                logging.info("Successfully created embeddings and index with OpenAI")
+                # Byte offsets of each document in the corpus, the same layout as the shared doc store
+                self.offsets = np.cumsum([0] + [len(doc.encode("utf-8")) for doc in self.docs], dtype=np.int64)
+
+        except Exception as e:
+            logging.error("Failed to load %s docs or embeddings from %s: %s", label, doc_path, e)
+            self.docs = []
+            self.index = None
+            self.version = ""
+            self.offsets = np.zeros(1, dtype=np.int64)
+        self.batcher = (
+            QueryBatcher(self.index, QUERY_BATCH_WINDOW_MS, QUERY_BATCH_MAX_SIZE, QUERY_BATCH_WORKERS)
+            if QUERY_BATCH_WINDOW_MS > 0 else None
+        )
+
+    @traced("search_docs")
+    def search_doc_ids(self, query, top_k=3, with_embedding=False):
+        """Search for relevant documents; returns their positions in docs.
+
+        Raises if there is no index or the query cannot be embedded: an empty result would
+        read as "nothing relevant" and be answered, and cached, as if the search had worked.
+        """
+        if self.index is None or len(self.docs) == 0:
+            raise RuntimeError(f"No {self.label} documents available for search")
+
+        if self.batcher is not None:
+            with timed("batch"):
+                D, I, q_emb = self.batcher.search(query, top_k)
+        else:
+            with timed("embed"):
+                q_emb = get_openai_embedding([query])
+            with timed("search"):
+                D, I = self.index.search(q_emb, top_k)
+            D, I, q_emb = D[0], I[0], q_emb[0]
+        doc_ids = [int(i) for i in I if 0 <= i < len(self.docs)]
+
+        # Debug logging
+        log_payload("query", "Search query: %s", query)
+        logging.debug("Found %d relevant documents", len(doc_ids))
+        log_payload("docs", "Retrieved documents: %s", [self.docs[i] for i in doc_ids])
+
+        return (doc_ids, q_emb) if with_embedding else doc_ids
+
+    def search_doc_ids_by_embedding(self, q_emb, top_k=3):
+        with timed("search"):
+            D, I = self.index.search(np.asarray([q_emb], dtype=np.float32), top_k)
+        return [int(i) for i in I[0] if 0 <= i < len(self.docs)]
+
+    def search_docs(self, query, top_k=3):
+        """Search for relevant documents"""
+        return [self.docs[i] for i in self.search_doc_ids(query, top_k)]
+
+    def source_fields(self, doc_ids, docs, source_format):
+        """Retrieved text by default; with source_format="ids", positions in the corpus instead of the text"""
+        if source_format == "ids":
+            return {
+                "sources": [
+                    {"id": i, "offset": int(self.offsets[i]), "length": int(self.offsets[i + 1] - self.offsets[i])}
+                    for i in doc_ids
+                ],
+                "corpus_version": self.version
+            }
+        return {"source_document": "\n".join(docs) if docs else ""}
@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import re
+import uuid
+
+import requests
+
+from agent_common.metrics import timed
+from agent_common.tracing import trace_headers, traced
+
+# -------------------------------------------------
+# SAP BTP calls (OAuth2 client credentials)
+# -------------------------------------------------
+SAP_TIMEOUT_S = float(os.getenv("SAP_TIMEOUT_S", "30"))
+
+@traced("get_sap_token")
+def get_sap_token():
+    """Fetch OAuth2 token from SAP BTP service key credentials."""
+    token_url = os.getenv("SAP_TOKEN_URL")
+    client_id = os.getenv("SAP_CLIENT_ID")
+    client_secret = os.getenv("SAP_CLIENT_SECRET")
+
+    if not all([token_url, client_id, client_secret]):
+        msg = "Missing SAP OAuth2 credentials in .env"
+        logging.error(msg)
+        raise RuntimeError(msg)
+
+    try:
+        with timed("sap_token"):
+            resp = requests.post(
+                token_url,
+                data={'grant_type': 'client_credentials'},
+                auth=(client_id, client_secret),
+                headers=trace_headers(),
+                timeout=SAP_TIMEOUT_S
+            )
+        resp.raise_for_status()
+        token = resp.json().get("access_token")
+        logging.info("SAP token retrieved successfully.")
+        return token
+    except Exception as e:
+        logging.error("Error fetching SAP token: %s", e)
+        raise
+
+def post_to_sap(url, payload, idempotency_key=None):
+    """POST an action payload to SAP and return (status_code, parsed response body)"""
+    token = get_sap_token()
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json",
+        **trace_headers()
+    }
+    if idempotency_key:
+        headers["Idempotency-Key"] = idempotency_key
+    with timed("sap_call"):
+        sap_resp = requests.post(url, json=payload, headers=headers, timeout=SAP_TIMEOUT_S)
+
+    if sap_resp.headers.get("Content-Type", "").startswith("application/json"):
+        return sap_resp.status_code, sap_resp.json()
+    return sap_resp.status_code, sap_resp.text
+
+# -------------------------------------------------
+# Bulk SAP submission (OData $batch)
+# -------------------------------------------------
+SAP_BATCH_URL = os.getenv("SAP_BATCH_URL", "")
+SAP_BATCH_SIZE = int(os.getenv("SAP_BATCH_SIZE", "100"))
+SAP_CHANGESET_SIZE = int(os.getenv("SAP_CHANGESET_SIZE", "1"))
+
+def chunked(items, size):
+    return [items[i:i + size] for i in range(0, len(items), max(1, size))]
+
+def build_batch_body(entity_set, changesets):
+    """Encode groups of payloads as one multipart/mixed $batch body, one change set per group"""
+    batch_boundary = f"batch_{uuid.uuid4().hex}"
+    lines = []
+    content_id = 0
+    for changeset in changesets:
+        changeset_boundary = f"changeset_{uuid.uuid4().hex}"
+        lines += [f"--{batch_boundary}", f"Content-Type: multipart/mixed; boundary={changeset_boundary}", ""]
+        for payload in changeset:
+            content_id += 1
+            lines += [
+                f"--{changeset_boundary}",
+                "Content-Type: application/http",
+                "Content-Transfer-Encoding: binary",
+                f"Content-ID: {content_id}",
+                "",
+                f"POST {entity_set} HTTP/1.1",
+                "Content-Type: application/json",
+                "",
+                json.dumps(payload)
+            ]
+        lines.append(f"--{changeset_boundary}--")
+    lines.append(f"--{batch_boundary}--")
+    return "\r\n".join(lines) + "\r\n", batch_boundary
+
+def split_multipart(content_type, body):
+    """Return (headers, content) for each part of a multipart body"""
+    match = re.search(r'boundary="?([^";]+)"?', content_type or "")
+    if not match:
+        return []
+    parts = []
+    for part in body.replace("\r\n", "\n").split(f"--{match.group(1)}")[1:]:
+        if part.startswith("--"):
+            break
+        headers, _, content = part.strip("\n").partition("\n\n")
+        parts.append((headers, content))
+    return parts
+
+def parse_http_part(content):
+    """Parse an embedded 'HTTP/1.1 201 Created' response into (status, body)"""
+    status_line, _, rest = content.partition("\n")
+    _, _, body = rest.partition("\n\n")
+    match = re.match(r"HTTP/\d\.\d (\d{3})", status_line)
+    status = int(match.group(1)) if match else "ERROR"
+    try:
+        return status, json.loads(body) if body.strip() else None
+    except ValueError:
+        return status, body.strip()
+
+def parse_batch_response(content_type, body, changesets):
+    """Map a $batch response back to one (status, body) per submitted item"""
+    results = []
+    parts = split_multipart(content_type, body)
+    for i, changeset in enumerate(changesets):
+        if i >= len(parts):
+            results += [("ERROR", "No response for change set")] * len(changeset)
+            continue
+        headers, content = parts[i]
+        nested = re.search(r"Content-Type:\s*(multipart/mixed;[^\n]+)", headers, re.IGNORECASE)
+        if nested:
+            responses = [parse_http_part(c) for _, c in split_multipart(nested.group(1), content)]
+            responses += [("ERROR", "No response for item")] * (len(changeset) - len(responses))
+            results += responses[:len(changeset)]
+        else:
+            # A failed change set is answered with a single error for all of its items
+            results += [parse_http_part(content)] * len(changeset)
+    return results
+
+@traced("submit_sap_batch")
+def submit_sap_batch(entity_set, items):
+    """Submit many payloads to entity_set through OData $batch and return one result per item, in order"""
+    if not SAP_BATCH_URL:
+        raise RuntimeError("SAP_BATCH_URL is not configured")
+    token = get_sap_token()
+    results = []
+    for chunk in chunked(items, SAP_BATCH_SIZE):
+        changesets = chunked(chunk, SAP_CHANGESET_SIZE)
+        body, boundary = build_batch_body(entity_set, changesets)
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": f"multipart/mixed; boundary={boundary}",
+            **trace_headers()
+        }
+        try:
+            with timed("sap_batch"):
+                sap_resp = requests.post(SAP_BATCH_URL, data=body.encode(), headers=headers, timeout=SAP_TIMEOUT_S)
+            if sap_resp.status_code >= 400:
+                chunk_results = [(sap_resp.status_code, sap_resp.text)] * len(chunk)
+            else:
+                chunk_results = parse_batch_response(sap_resp.headers.get("Content-Type"), sap_resp.text, changesets)
+        except Exception as e:
+            logging.error("SAP $batch call failed: %s", e)
+            chunk_results = [("ERROR", str(e))] * len(chunk)
+        results += chunk_results
+    logging.info("Submitted %d items to SAP in %d $batch request(s)", len(items), len(chunked(items, SAP_BATCH_SIZE)))
+    return [
+        {
+            "item": item,
+            "sap_api_status": status,
+            "sap_api_result": result,
+            "succeeded": isinstance(status, int) and status < 400
+        }
+        for item, (status, result) in zip(items, results)
+    ]
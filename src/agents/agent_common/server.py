@@ -0,0 +1,89 @@
+import os
+import time
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+
+from agent_common.action_queue import get_job
+from agent_common.metrics import REQUESTS_IN_FLIGHT, SERVER_TIMING, format_server_timing, metrics_response
+from agent_common.tracing import CURRENT_SPAN, start_trace
+
+GZIP_MIN_SIZE = int(os.getenv("GZIP_MIN_SIZE", "1024"))
+
+def create_app(service_name, corpus):
+    """The agent's FastAPI app with metrics, tracing and the endpoints every agent serves.
+
+    SERVICE_NAME overrides service_name, the name the agent's spans are exported under.
+    """
+    service_name = os.getenv("SERVICE_NAME", service_name)
+    app = FastAPI(default_response_class=ORJSONResponse)
+    # Compress larger responses for callers that send Accept-Encoding: gzip
+    app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE)
+
+    @app.middleware("http")
+    async def record_request_metrics(request: Request, call_next):
+        timings = []
+        token = SERVER_TIMING.set(timings)
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            SERVER_TIMING.reset(token)
+        timings.append(("agent", time.perf_counter() - start))
+        response.headers["Server-Timing"] = format_server_timing(timings)
+        if corpus.version:
+            response.headers["X-Corpus-Version"] = corpus.version
+        return response
+
+    @app.middleware("http")
+    async def trace_request(request: Request, call_next):
+        if request.url.path in ("/health", "/metrics"):
+            return await call_next(request)
+        root = start_trace(f"{request.method} {request.url.path}", request.headers.get("traceparent"), service_name)
+        token = CURRENT_SPAN.set(root)
+        try:
+            response = await call_next(request)
+            root.attributes["http.status_code"] = response.status_code
+        finally:
+            CURRENT_SPAN.reset(token)
+            root.end()
+        response.headers["traceparent"] = root.traceparent()
+        return response
+
+    # -------------------------------------------------
+    # Health check endpoint
+    # -------------------------------------------------
+    @app.get("/health")
+    def health_check():
+        return {"status": "ok"}
+
+    # -------------------------------------------------
+    # Metrics endpoint (Prometheus text format)
+    # -------------------------------------------------
+    @app.get("/metrics")
+    def metrics():
+        return metrics_response()
+
+    # -------------------------------------------------
+    # SAP action job status (ACTION_QUEUE_MODE)
+    # -------------------------------------------------
+    @app.get("/jobs/{job_id}")
+    def job_status(job_id: str):
+        job = get_job(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+        return job
+
+    # -------------------------------------------------
+    # Source documents by id (for source_format="ids")
+    # -------------------------------------------------
+    @app.get("/documents/{doc_id}")
+    def get_document(doc_id: int):
+        if not 0 <= doc_id < len(corpus.docs):
+            raise HTTPException(status_code=404, detail=f"Document {doc_id} not found")
+        return {"id": doc_id, "text": corpus.docs[doc_id], "corpus_version": corpus.version}
+
+    return app
@@ -0,0 +1,96 @@
+import collections
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from agent_common.cascade import content_words
+from agent_common.metrics import CACHE_REQUESTS, timed
+from agent_common.retrieval import get_openai_embedding
+
+# -------------------------------------------------
+# Conversation sessions (optional session_id on /task)
+# -------------------------------------------------
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", "1800"))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "6"))
+SESSION_HISTORY_TOKENS = int(os.getenv("SESSION_HISTORY_TOKENS", "300"))
+SESSION_SUMMARY_CHARS = int(os.getenv("SESSION_SUMMARY_CHARS", "200"))
+FOLLOW_UP_RE = re.compile(
+    r"^(and|also|what about|how about|what if|then|so|but)\b|\b(it|its|that|this|those|these|they|them|same|mentioned)\b",
+    re.IGNORECASE
+)
+
+def summarize_turn(text):
+    """First sentence, capped: enough to resolve "it" or "that" in a follow-up"""
+    return re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0][:SESSION_SUMMARY_CHARS]
+
+class Session:
+    def __init__(self):
+        self.turns = collections.deque(maxlen=SESSION_MAX_TURNS)  # (question, answer) summaries
+        self.doc_ids = []
+        self.embedding = None  # retrieval embedding of the last turn
+        self.touched = time.monotonic()
+
+    def remember(self, question, answer, doc_ids):
+        self.turns.append((summarize_turn(question), summarize_turn(answer)))
+        self.doc_ids = doc_ids
+
+    def history(self):
+        """Most recent turns that fit in SESSION_HISTORY_TOKENS (about 4 characters per token)"""
+        lines, budget = [], SESSION_HISTORY_TOKENS * 4
+        for question, answer in reversed(self.turns):
+            line = f"User: {question}\nAssistant: {answer}"
+            if len(line) > budget:
+                break
+            lines.insert(0, line)
+            budget -= len(line)
+        return "\n".join(lines)
+
+class SessionStore:
+    """In-memory conversations; the least recently used is evicted first and idle ones expire"""
+
+    def __init__(self, max_sessions, ttl_s):
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self.sessions = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self.lock:
+            # Ordered by last use, so expired sessions are all at the front
+            while self.sessions and now - next(iter(self.sessions.values())).touched > self.ttl_s:
+                self.sessions.popitem(last=False)
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self.sessions[session_id] = Session()
+                while len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+            self.sessions.move_to_end(session_id)
+            session.touched = now
+            return session
+
+SESSIONS = SessionStore(SESSION_MAX, SESSION_TTL_S)
+
+def session_doc_ids(corpus, query, session):
+    """Retrieval for a session turn: reuse the last turn's documents, steer the search with it, or start fresh"""
+    if session.doc_ids and session.turns and FOLLOW_UP_RE.search(query):
+        known = content_words(" ".join([session.turns[-1][0]] + [corpus.docs[i] for i in session.doc_ids]))
+        if content_words(query) <= known:
+            CACHE_REQUESTS.labels("session_retrieval", "reused").inc()
+            return session.doc_ids
+        if session.embedding is not None:
+            # "What about X?" alone embeds poorly; average it with the conversation so far
+            with timed("embed"):
+                q_emb = get_openai_embedding([query])[0]
+            blended = np.asarray(session.embedding, dtype=np.float32) + np.asarray(q_emb, dtype=np.float32)
+            session.embedding = blended / (np.linalg.norm(blended) or 1.0)
+            CACHE_REQUESTS.labels("session_retrieval", "blended").inc()
+            return corpus.search_doc_ids_by_embedding(session.embedding)
+    doc_ids, embedding = corpus.search_doc_ids(query, with_embedding=True)
+    session.embedding = embedding
+    CACHE_REQUESTS.labels("session_retrieval", "fresh").inc()
+    return doc_ids
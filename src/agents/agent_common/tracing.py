@@ -0,0 +1,133 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+# -------------------------------------------------
+# Tracing (W3C traceparent) with sampled span export
+# -------------------------------------------------
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", "0.1"))
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE", "")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+CURRENT_SPAN = contextvars.ContextVar("current_span", default=None)
+SPAN_EXPORT_QUEUE = queue.Queue(maxsize=10000)
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, sampled, attributes=None, service=""):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = attributes or {}
+        self.service = service
+        self.start_ns = time.time_ns()
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def end(self):
+        if not self.sampled or not (TRACE_EXPORT_FILE or TRACE_OTLP_ENDPOINT):
+            return
+        try:
+            SPAN_EXPORT_QUEUE.put_nowait({
+                "service": self.service,
+                "name": self.name,
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "start_ns": self.start_ns,
+                "end_ns": time.time_ns(),
+                "attributes": self.attributes
+            })
+        except queue.Full:
+            pass  # Drop spans rather than slow down requests
+
+def start_trace(name, traceparent=None, service=""):
+    """Continue the caller's trace if a valid traceparent was sent, otherwise start a sampled-or-not new one"""
+    match = TRACEPARENT_RE.match(traceparent or "")
+    if match and match.group(1) != "0" * 32:
+        return Span(name, match.group(1), match.group(2), match.group(3) == "01", service=service)
+    return Span(name, secrets.token_hex(16), None, random.random() < TRACE_SAMPLE_RATIO, service=service)
+
+@contextmanager
+def span(name, **attributes):
+    parent = CURRENT_SPAN.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, parent.trace_id, parent.span_id, parent.sampled, attributes, parent.service)
+    token = CURRENT_SPAN.set(child)
+    try:
+        yield child
+    except Exception as e:
+        child.attributes["error"] = str(e)
+        raise
+    finally:
+        CURRENT_SPAN.reset(token)
+        child.end()
+
+def traced(name):
+    """Decorator: run the function inside a child span of the current request"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def trace_headers():
+    """Headers that carry the current trace to an outbound call"""
+    current = CURRENT_SPAN.get()
+    return {"traceparent": current.traceparent()} if current else {}
+
+def export_spans():
+    while True:
+        batch = [SPAN_EXPORT_QUEUE.get()]
+        while len(batch) < 512:
+            try:
+                batch.append(SPAN_EXPORT_QUEUE.get(timeout=1.0))
+            except queue.Empty:
+                break
+        try:
+            if TRACE_EXPORT_FILE:
+                with open(TRACE_EXPORT_FILE, "a") as f:
+                    f.writelines(json.dumps(item) + "\n" for item in batch)
+            if TRACE_OTLP_ENDPOINT:
+                requests.post(TRACE_OTLP_ENDPOINT, json=to_otlp(batch), timeout=5)
+        except Exception as e:
+            logging.warning("Span export failed: %s", e)
+
+def to_otlp(batch):
+    """Convert exported spans to an OTLP/HTTP JSON payload, one resource per service"""
+    by_service = {}
+    for item in batch:
+        by_service.setdefault(item["service"], []).append({
+            "traceId": item["trace_id"],
+            "spanId": item["span_id"],
+            "parentSpanId": item["parent_id"] or "",
+            "name": item["name"],
+            "startTimeUnixNano": str(item["start_ns"]),
+            "endTimeUnixNano": str(item["end_ns"]),
+            "attributes": [{"key": k, "value": {"stringValue": str(v)}} for k, v in item["attributes"].items()]
+        })
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+        "scopeSpans": [{"scope": {"name": service}, "spans": spans}]
+    } for service, spans in by_service.items()]}
+
+if TRACE_EXPORT_FILE or TRACE_OTLP_ENDPOINT:
+    threading.Thread(target=export_spans, daemon=True).start()
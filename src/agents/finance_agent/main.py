@@ -1,129 +1,44 @@
-import requests
 import os
+import re
 import logging
-from fastapi import FastAPI
+from datetime import date, timedelta
+from fastapi import Header, Response
+from typing import Optional
 from pydantic import BaseModel
-import faiss
-import numpy as np
-from langchain_community.chat_models import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from dotenv import load_dotenv
-from openai import OpenAI
-
-# -------------------------------------------------
-# Configure logging
-# -------------------------------------------------
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s"
-)
-
-app = FastAPI()
-
-# -------------------------------------------------
-# OpenAI Embedding Function (replacing HuggingFace)
-# -------------------------------------------------
-def get_openai_embedding(texts):
-    """Use OpenAI embeddings instead of HuggingFace"""
-    try:
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        
-        if isinstance(texts, str):
-            texts = [texts]
-            
-        response = client.embeddings.create(
-            input=texts,
-            model="text-embedding-ada-002"
-        )
-        
-        embeddings = [item.embedding for item in response.data]
-        return np.array(embeddings)
-        
-    except Exception as e:
-        logging.error(f"OpenAI embedding error: {e}")
-        raise
+from agent_common.logs import DroppingQueueHandler, log_payload
+from agent_common.metrics import timed
+from agent_common.tracing import traced
+from agent_common.retrieval import Corpus
+from agent_common.cascade import generate_answer
+from agent_common.sap import post_to_sap
+from agent_common.action_queue import ACTION_QUEUE_MODE, bulk_response, enqueue_sap_action
+from agent_common.sessions import SESSIONS, session_doc_ids
+from agent_common.server import create_app
 
 # -------------------------------------------------
 # Load Finance reference documents and embeddings
 # -------------------------------------------------
-try:
-    DOC_PATH = os.path.join(os.path.dirname(__file__), "finance_docs.txt")
-    with open(DOC_PATH, "r") as f:
-        FINANCE_DOCS = [line.strip() for line in f if line.strip()]
-    
-    logging.info(f"Loaded {len(FINANCE_DOCS)} Finance document lines from {DOC_PATH}")
-    logging.info(f"First document: {FINANCE_DOCS[0] if FINANCE_DOCS else 'NONE'}")
-    
-    FIN_EMB = get_openai_embedding(FINANCE_DOCS)
-    INDEX = faiss.IndexFlatL2(FIN_EMB.shape[1])
-    INDEX.add(FIN_EMB)
-    logging.info(f"Successfully created embeddings and index with OpenAI")
-    
-except Exception as e:
-    logging.error("Failed to load Finance docs or embeddings: %s", e)
-    logging.error(f"Current working directory: {os.getcwd()}")
-    logging.error(f"Files in current directory: {os.listdir('.')}")
-    FINANCE_DOCS = []
-    INDEX = None
+DOMAIN = "finance"  # this agent's domain at the gateway (/workflow/finance/...)
+CORPUS = Corpus(DOMAIN, "Finance", os.path.join(os.path.dirname(__file__), "finance_docs.txt"))
 
-def search_docs(query, top_k=3):
-    """Search for relevant Finance documents"""
-    try:
-        if INDEX is None or len(FINANCE_DOCS) == 0:
-            logging.warning("No Finance documents available for search")
-            return []
-            
-        q_emb = get_openai_embedding([query])
-        D, I = INDEX.search(q_emb, top_k)
-        results = [FINANCE_DOCS[i] for i in I[0] if i < len(FINANCE_DOCS)]
-        
-        # Debug logging
-        logging.info(f"Search query: {query}")
-        logging.info(f"Found {len(results)} relevant documents")
-        for i, doc in enumerate(results):
-            logging.info(f"Doc {i}: {doc[:100]}...")
-            
-        return results
-    except Exception as e:
-        logging.error("Error searching Finance docs: %s", e)
-        return []
+app = create_app("finance-agent", CORPUS)
 
 # -------------------------------------------------
-# Load environment variables and LLM
+# Finance prompt and SAP endpoints
 # -------------------------------------------------
-load_dotenv()
-
-llm = ChatOpenAI(
-    model="gpt-3.5-turbo",
-    openai_api_key=os.getenv("OPENAI_API_KEY")
-)
+PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are an expert Finance assistant for this company. 
+    Use ONLY the provided company Finance documents to answer questions accurately. 
+    If the information is not in the documents, say so clearly.
+    Be specific and cite the exact information from the documents."""),
+    ("human", "Company Finance Documents:\n{context}\n\n{history}Question: {question}\n\nAnswer based on the company documents:")
+])
 
 SAP_API_URL_INVOICE = os.getenv("SAP_API_URL_INVOICE", "")
-
-def get_sap_token():
-    """Fetch OAuth2 token from SAP BTP service key credentials."""
-    token_url = os.getenv("SAP_TOKEN_URL")
-    client_id = os.getenv("SAP_CLIENT_ID")
-    client_secret = os.getenv("SAP_CLIENT_SECRET")
-
-    if not all([token_url, client_id, client_secret]):
-        msg = "Missing SAP OAuth2 credentials in .env"
-        logging.error(msg)
-        raise RuntimeError(msg)
-
-    try:
-        resp = requests.post(
-            token_url,
-            data={'grant_type': 'client_credentials'},
-            auth=(client_id, client_secret)
-        )
-        resp.raise_for_status()
-        token = resp.json().get("access_token")
-        logging.info("SAP token retrieved successfully.")
-        return token
-    except Exception as e:
-        logging.error("Error fetching SAP token: %s", e)
-        raise
+SAP_BATCH_ENTITY_SET = os.getenv("SAP_BATCH_ENTITY_SET", "Invoices")
+# Due date for invoices whose request does not give one ("... due 2025-10-31")
+INVOICE_PAYMENT_TERMS_DAYS = int(os.getenv("INVOICE_PAYMENT_TERMS_DAYS", "30"))
 
 def detect_intent(query: str):
     """Detect if query is informational or action-based"""
@@ -150,65 +65,64 @@ def detect_intent(query: str):
         # Default to information for safety
         return "information"
 
-def generate_answer(query, context_docs):
-    """Generate answer using retrieved documents as context"""
-    try:
-        if not context_docs:
-            context = "No relevant company documents found."
-        else:
-            context = "\n\n".join(context_docs)
-        
-        # Debug logging
-        logging.info(f"Context being sent to LLM: {context[:300]}...")
-        
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an expert Finance assistant for this company. 
-            Use ONLY the provided company Finance documents to answer questions accurately. 
-            If the information is not in the documents, say so clearly.
-            Be specific and cite the exact information from the documents."""),
-            ("human", "Company Finance Documents:\n{context}\n\nQuestion: {question}\n\nAnswer based on the company documents:")
-        ])
-        
-        response = llm.invoke(prompt.format_messages(question=query, context=context))
-        
-        # Debug logging
-        logging.info(f"LLM response: {response.content[:200]}...")
-        
-        return response.content
-    except Exception as e:
-        logging.error("Error generating LLM answer: %s", e)
-        return "Error generating answer."
+def parse_invoice_lines(task_text):
+    """Helper: one invoice per "INV-... [from <vendor>] for <amount> [<currency>] [due <YYYY-MM-DD>]" mention"""
+    pattern = r'(INV-[\w-]+)(?:\s+from\s+(.+?))?\s+for\s+([\d,]+(?:\.\d+)?)\s*([A-Z]{3})?(?:\s+due\s+(\d{4}-\d{2}-\d{2}))?'
+    default_due_date = (date.today() + timedelta(days=INVOICE_PAYMENT_TERMS_DAYS)).isoformat()
+    return [
+        {
+            "invoiceNumber": number,
+            "vendorName": vendor.strip(),
+            "amount": float(amount.replace(",", "")),
+            "currency": currency or "USD",
+            "dueDate": due_date or default_due_date
+        }
+        for number, vendor, amount, currency, due_date in re.findall(pattern, task_text)
+    ]
+
+def reject_invoice_action(context_answer, sources, invoice_numbers):
+    """Answer without calling SAP when a parsed invoice does not name its vendor"""
+    logging.warning("Not submitting invoices without a vendor: %s", invoice_numbers)
+    return {
+        "result": context_answer,
+        **sources,
+        "action_performed": "invoice_rejected",
+        "message": f"No vendor given for {', '.join(invoice_numbers)}; "
+                   "name it as \"INV-... from <vendor> for <amount>\" to submit."
+    }
+
+@traced("process_bulk_invoice_action")
+def process_bulk_invoice_action(query, context_answer, sources, invoices, idempotency_key=None):
+    """Process an invoice run as one OData $batch submission"""
+    return bulk_response(
+        DOMAIN, context_answer, sources, "invoice", SAP_BATCH_ENTITY_SET, invoices, idempotency_key
+    )
 
-def process_invoice_action(query, context_answer, context_docs):
+@traced("process_invoice_action")
+def process_invoice_action(query, context_answer, sources, idempotency_key=None, invoice=None):
     """Process invoice action with SAP API call"""
-    payload = {
-        "invoiceNumber": "INV-20230815-001",  # This should be extracted from user input
+    payload = invoice or {
+        "invoiceNumber": "INV-20230815-001",  # Used when no invoice could be parsed from the request
         "vendorName": "ACME Supplies",
         "amount": 1250.0,
         "currency": "USD",
         "dueDate": "2025-09-30"
     }
     
+    if ACTION_QUEUE_MODE:
+        return enqueue_sap_action(
+            DOMAIN, "invoice", SAP_API_URL_INVOICE, payload, context_answer, sources, idempotency_key
+        )
+
     try:
-        token = get_sap_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
         logging.info("Sending invoice request to SAP: %s", SAP_API_URL_INVOICE)
-        sap_resp = requests.post(SAP_API_URL_INVOICE, json=payload, headers=headers)
-        sap_status = sap_resp.status_code
-
-        if sap_resp.headers.get("Content-Type", "").startswith("application/json"):
-            sap_result = sap_resp.json()
-        else:
-            sap_result = sap_resp.text
+        sap_status, sap_result = post_to_sap(SAP_API_URL_INVOICE, payload)
 
         logging.info("SAP Invoice API Response Status: %s", sap_status)
         
         return {
             "result": context_answer,
-            "source_document": "\n".join(context_docs) if context_docs else "",
+            **sources,
             "sap_api_status": sap_status,
             "sap_api_result": sap_result,
             "action_performed": "invoice_submitted"
@@ -221,7 +135,7 @@ def process_invoice_action(query, context_answer, context_docs):
         
         return {
             "result": context_answer,
-            "source_document": "\n".join(context_docs) if context_docs else "",
+            **sources,
             "sap_api_status": sap_status,
             "sap_api_result": sap_result,
             "action_performed": "invoice_failed"
@@ -232,13 +146,21 @@ def process_invoice_action(query, context_answer, context_docs):
 # -------------------------------------------------
 class TaskRequest(BaseModel):
     task: str
+    source_format: str = "text"  # 'text' or 'ids'
+    session_id: Optional[str] = None  # optional; follow-ups in the same session reuse retrieval and history
+
+class BulkRequest(BaseModel):
+    items: list[dict]
 
 # -------------------------------------------------
-# Health check endpoint
+# Bulk endpoint: many invoices in one OData $batch
 # -------------------------------------------------
-@app.get("/health")
-def health_check():
-    return {"status": "ok"}
+@app.post("/bulk")
+def execute_bulk(request: BulkRequest, idempotency_key: str = Header(default=None)):
+    return bulk_response(
+        DOMAIN, f"Bulk submission of {len(request.items)} invoices", {"source_document": ""},
+        "invoice", SAP_BATCH_ENTITY_SET, request.items, idempotency_key
+    )
 
 # -------------------------------------------------
 # Debug endpoint
@@ -248,29 +170,45 @@ def debug_info():
     return {
         "message": "FINANCE AGENT WITH OPENAI EMBEDDINGS",
         "timestamp": "2025-08-21-9:09PM",
-        "finance_docs_count": len(FINANCE_DOCS),
-        "sample_finance_doc": FINANCE_DOCS[0] if FINANCE_DOCS else "NO DOCS LOADED",
-        "index_status": "LOADED" if INDEX is not None else "NOT LOADED"
+        "finance_docs_count": len(CORPUS.docs),
+        "sample_finance_doc": CORPUS.docs[0] if CORPUS.docs else "NO DOCS LOADED",
+        "index_status": "LOADED" if CORPUS.index is not None else "NOT LOADED",
+        "corpus_version": CORPUS.version,
+        "log_records_dropped": DroppingQueueHandler.dropped
     }
 
 # -------------------------------------------------
 # Main endpoint for Finance tasks
 # -------------------------------------------------
 @app.post("/task")
-def execute_task(request: TaskRequest):
-    logging.info("Received task: %s", request.task)
+def execute_task(request: TaskRequest, response: Response, idempotency_key: str = Header(default=None)):
+    result = run_task(request, idempotency_key)
+    # Lets the gateway count failures without parsing the body
+    if isinstance(result, dict) and "error" in result:
+        response.headers["X-Agent-Error"] = "true"
+    return result
+
+def run_task(request, idempotency_key):
+    log_payload("task", "Received task: %s", request.task)
     
     try:
         # Step 1: Always retrieve relevant documents first
-        relevant_docs = search_docs(request.task)
+        session = SESSIONS.get(request.session_id) if request.session_id else None
+        doc_ids = session_doc_ids(CORPUS, request.task, session) if session else CORPUS.search_doc_ids(request.task)
+        relevant_docs = [CORPUS.docs[i] for i in doc_ids]
         
         # Step 2: Generate answer using retrieved context
-        answer = generate_answer(request.task, relevant_docs)
+        answer = generate_answer(PROMPT, request.task, relevant_docs, session.history() if session else "")
+        if session:
+            session.remember(request.task, answer, doc_ids)
+        
+        sources = CORPUS.source_fields(doc_ids, relevant_docs, request.source_format)
         
         # Step 3: Detect intent (information vs action)
-        intent = detect_intent(request.task)
+        with timed("intent"):
+            intent = detect_intent(request.task)
         
-        logging.info(f"Intent detected: {intent}")
+        logging.debug("Intent detected: %s", intent)
         
         # Step 4: Handle based on intent and topic
         query_lower = request.task.lower()
@@ -278,13 +216,21 @@ def execute_task(request: TaskRequest):
         # Action-based requests
         if intent == "action":
             if "invoice" in query_lower:
-                return process_invoice_action(request.task, answer, relevant_docs)
+                invoices = parse_invoice_lines(request.task)
+                missing_vendor = [invoice["invoiceNumber"] for invoice in invoices if not invoice["vendorName"]]
+                if missing_vendor:
+                    return reject_invoice_action(answer, sources, missing_vendor)
+                if len(invoices) > 1:
+                    return process_bulk_invoice_action(request.task, answer, sources, invoices, idempotency_key)
+                return process_invoice_action(
+                    request.task, answer, sources, idempotency_key, invoices[0] if invoices else None
+                )
             # Add more finance actions here as needed
         
         # Information-based requests (default)
         return {
             "result": answer,
-            "source_document": "\n".join(relevant_docs) if relevant_docs else "",
+            **sources,
             "intent_detected": intent
         }
 
@@ -1,131 +1,41 @@
-import requests
 import os
 import logging
-from fastapi import FastAPI
+from fastapi import Header, Response
+from typing import Optional
 from pydantic import BaseModel
-import faiss
-import numpy as np
-from langchain_community.chat_models import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from dotenv import load_dotenv
-from openai import OpenAI
-
-# -------------------------------------------------
-# Configure logging
-# -------------------------------------------------
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s"
-)
-
-app = FastAPI()
-
-# -------------------------------------------------
-# OpenAI Embedding Function (replacing HuggingFace)
-# -------------------------------------------------
-def get_openai_embedding(texts):
-    """Use OpenAI embeddings instead of HuggingFace"""
-    try:
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        
-        if isinstance(texts, str):
-            texts = [texts]
-            
-        response = client.embeddings.create(
-            input=texts,
-            model="text-embedding-ada-002"
-        )
-        
-        embeddings = [item.embedding for item in response.data]
-        return np.array(embeddings)
-        
-    except Exception as e:
-        logging.error(f"OpenAI embedding error: {e}")
-        raise
+from agent_common.logs import DroppingQueueHandler, log_payload
+from agent_common.metrics import timed
+from agent_common.tracing import traced
+from agent_common.retrieval import Corpus
+from agent_common.cascade import generate_answer
+from agent_common.sap import post_to_sap
+from agent_common.action_queue import ACTION_QUEUE_MODE, enqueue_sap_action
+from agent_common.sessions import SESSIONS, session_doc_ids
+from agent_common.server import create_app
 
 # -------------------------------------------------
 # Load HR reference documents and embeddings
 # -------------------------------------------------
-try:
-    DOC_PATH = os.path.join(os.path.dirname(__file__), "hr_docs.txt")
-    with open(DOC_PATH, "r") as f:
-        HR_DOCS = [line.strip() for line in f if line.strip()]
-    
-    logging.info(f"Loaded {len(HR_DOCS)} HR document lines from {DOC_PATH}")
-    logging.info(f"First document: {HR_DOCS[0] if HR_DOCS else 'NONE'}")
-    
-    HR_EMB = get_openai_embedding(HR_DOCS)  # CHANGED: was get_remote_embedding
-    INDEX = faiss.IndexFlatL2(HR_EMB.shape[1])
-    INDEX.add(HR_EMB)
-    logging.info(f"Successfully created embeddings and index with OpenAI")
-    
-except Exception as e:
-    logging.error("Failed to load HR docs or embeddings: %s", e)
-    logging.error(f"Current working directory: {os.getcwd()}")
-    logging.error(f"Files in current directory: {os.listdir('.')}")
-    HR_DOCS = []
-    INDEX = None
+DOMAIN = "hr"  # this agent's domain at the gateway (/workflow/hr/...)
+CORPUS = Corpus(DOMAIN, "HR", os.path.join(os.path.dirname(__file__), "hr_docs.txt"))
 
-def search_docs(query, top_k=3):
-    """Search for relevant HR documents"""
-    try:
-        if INDEX is None or len(HR_DOCS) == 0:
-            logging.warning("No HR documents available for search")
-            return []
-            
-        q_emb = get_openai_embedding([query])  # CHANGED: was get_remote_embedding
-        D, I = INDEX.search(q_emb, top_k)
-        results = [HR_DOCS[i] for i in I[0] if i < len(HR_DOCS)]
-        
-        # Debug logging
-        logging.info(f"Search query: {query}")
-        logging.info(f"Found {len(results)} relevant documents")
-        for i, doc in enumerate(results):
-            logging.info(f"Doc {i}: {doc[:100]}...")
-            
-        return results
-    except Exception as e:
-        logging.error("Error searching HR docs: %s", e)
-        return []
+app = create_app("hr-agent", CORPUS)
 
 # -------------------------------------------------
-# Load environment variables and LLM
+# HR prompt and SAP endpoints
 # -------------------------------------------------
-load_dotenv()
-
-llm = ChatOpenAI(
-    model="gpt-3.5-turbo",
-    openai_api_key=os.getenv("OPENAI_API_KEY")
-)
+PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are an expert HR assistant for this company. 
+    Use ONLY the provided company HR documents to answer questions accurately. 
+    If the information is not in the documents, say so clearly.
+    Be specific and cite the exact information from the documents."""),
+    ("human", "Company HR Documents:\n{context}\n\n{history}Question: {question}\n\nAnswer based on the company documents:")
+])
 
 SAP_API_URL_HR = os.getenv("SAP_API_URL_HR", "")
 SAP_API_URL_LEAVE = os.getenv("SAP_API_URL_LEAVE", "")
 
-def get_sap_token():
-    """Fetch OAuth2 token from SAP BTP service key credentials."""
-    token_url = os.getenv("SAP_TOKEN_URL")
-    client_id = os.getenv("SAP_CLIENT_ID")
-    client_secret = os.getenv("SAP_CLIENT_SECRET")
-
-    if not all([token_url, client_id, client_secret]):
-        msg = "Missing SAP OAuth2 credentials in .env"
-        logging.error(msg)
-        raise RuntimeError(msg)
-
-    try:
-        resp = requests.post(
-            token_url,
-            data={'grant_type': 'client_credentials'},
-            auth=(client_id, client_secret)
-        )
-        resp.raise_for_status()
-        token = resp.json().get("access_token")
-        logging.info("SAP token retrieved successfully.")
-        return token
-    except Exception as e:
-        logging.error("Error fetching SAP token: %s", e)
-        raise
-
 def detect_intent(query: str):
     """Detect if query is informational or action-based"""
     action_patterns = [
@@ -150,36 +60,8 @@ def detect_intent(query: str):
         # Default to information for safety
         return "information"
 
-def generate_answer(query, context_docs):
-    """Generate answer using retrieved documents as context"""
-    try:
-        if not context_docs:
-            context = "No relevant company documents found."
-        else:
-            context = "\n\n".join(context_docs)
-        
-        # Debug logging
-        logging.info(f"Context being sent to LLM: {context[:300]}...")
-        
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an expert HR assistant for this company. 
-            Use ONLY the provided company HR documents to answer questions accurately. 
-            If the information is not in the documents, say so clearly.
-            Be specific and cite the exact information from the documents."""),
-            ("human", "Company HR Documents:\n{context}\n\nQuestion: {question}\n\nAnswer based on the company documents:")
-        ])
-        
-        response = llm.invoke(prompt.format_messages(question=query, context=context))
-        
-        # Debug logging
-        logging.info(f"LLM response: {response.content[:200]}...")
-        
-        return response.content
-    except Exception as e:
-        logging.error("Error generating LLM answer: %s", e)
-        return "Error generating answer."
-
-def process_leave_action(query, context_answer, context_docs):
+@traced("process_leave_action")
+def process_leave_action(query, context_answer, sources, idempotency_key=None):
     """Process leave request action with SAP API call"""
     payload = {
         "employeeName": "John Smith",  # This should be extracted from user input
@@ -188,26 +70,20 @@ def process_leave_action(query, context_answer, context_docs):
         "endDate": "2025-09-10"
     }
     
+    if ACTION_QUEUE_MODE:
+        return enqueue_sap_action(
+            DOMAIN, "leave_request", SAP_API_URL_LEAVE, payload, context_answer, sources, idempotency_key
+        )
+
     try:
-        token = get_sap_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
         logging.info("Sending leave request to SAP: %s", SAP_API_URL_LEAVE)
-        sap_resp = requests.post(SAP_API_URL_LEAVE, json=payload, headers=headers)
-        sap_status = sap_resp.status_code
-
-        if sap_resp.headers.get("Content-Type", "").startswith("application/json"):
-            sap_result = sap_resp.json()
-        else:
-            sap_result = sap_resp.text
+        sap_status, sap_result = post_to_sap(SAP_API_URL_LEAVE, payload)
 
         logging.info("SAP Leave API Response Status: %s", sap_status)
         
         return {
             "result": context_answer,
-            "source_document": "\n".join(context_docs) if context_docs else "",
+            **sources,
             "sap_api_status": sap_status,
             "sap_api_result": sap_result,
             "action_performed": "leave_request_submitted"
@@ -220,13 +96,14 @@ def process_leave_action(query, context_answer, context_docs):
         
         return {
             "result": context_answer,
-            "source_document": "\n".join(context_docs) if context_docs else "",
+            **sources,
             "sap_api_status": sap_status,
             "sap_api_result": sap_result,
             "action_performed": "leave_request_failed"
         }
 
-def process_onboarding_action(query, context_answer, context_docs):
+@traced("process_onboarding_action")
+def process_onboarding_action(query, context_answer, sources, idempotency_key=None):
     """Process onboarding action with SAP API call"""
     payload = {
         "employeeName": "Jane Doe",  # This should be extracted from user input
@@ -234,26 +111,20 @@ def process_onboarding_action(query, context_answer, context_docs):
         "startDate": "2025-08-14"
     }
     
+    if ACTION_QUEUE_MODE:
+        return enqueue_sap_action(
+            DOMAIN, "onboarding", SAP_API_URL_HR, payload, context_answer, sources, idempotency_key
+        )
+
     try:
-        token = get_sap_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
         logging.info("Sending onboarding request to SAP: %s", SAP_API_URL_HR)
-        sap_resp = requests.post(SAP_API_URL_HR, json=payload, headers=headers)
-        sap_status = sap_resp.status_code
-
-        if sap_resp.headers.get("Content-Type", "").startswith("application/json"):
-            sap_result = sap_resp.json()
-        else:
-            sap_result = sap_resp.text
+        sap_status, sap_result = post_to_sap(SAP_API_URL_HR, payload)
 
         logging.info("SAP Onboarding API Response Status: %s", sap_status)
         
         return {
             "result": context_answer,
-            "source_document": "\n".join(context_docs) if context_docs else "",
+            **sources,
             "sap_api_status": sap_status,
             "sap_api_result": sap_result,
             "action_performed": "onboarding_submitted"
@@ -266,7 +137,7 @@ def process_onboarding_action(query, context_answer, context_docs):
         
         return {
             "result": context_answer,
-            "source_document": "\n".join(context_docs) if context_docs else "",
+            **sources,
             "sap_api_status": sap_status,
             "sap_api_result": sap_result,
             "action_performed": "onboarding_failed"
@@ -277,13 +148,9 @@ def process_onboarding_action(query, context_answer, context_docs):
 # -------------------------------------------------
 class TaskRequest(BaseModel):
     task: str
+    source_format: str = "text"  # 'text' or 'ids'
+    session_id: Optional[str] = None  # optional; follow-ups in the same session reuse retrieval and history
 
-# -------------------------------------------------
-# Health check endpoint
-# -------------------------------------------------
-@app.get("/health")
-def health_check():
-    return {"status": "ok"}
 
 # -------------------------------------------------
 # Debug endpoint
@@ -293,29 +160,45 @@ def debug_info():
     return {
         "message": "NEW CODE WITH OPENAI EMBEDDINGS",
         "timestamp": "2025-08-21-8:44PM",
-        "hr_docs_count": len(HR_DOCS),
-        "sample_hr_doc": HR_DOCS[0] if HR_DOCS else "NO DOCS LOADED",
-        "index_status": "LOADED" if INDEX is not None else "NOT LOADED"
+        "hr_docs_count": len(CORPUS.docs),
+        "sample_hr_doc": CORPUS.docs[0] if CORPUS.docs else "NO DOCS LOADED",
+        "index_status": "LOADED" if CORPUS.index is not None else "NOT LOADED",
+        "corpus_version": CORPUS.version,
+        "log_records_dropped": DroppingQueueHandler.dropped
     }
 
 # -------------------------------------------------
 # Main endpoint for HR tasks
 # -------------------------------------------------
 @app.post("/task")
-def execute_task(request: TaskRequest):
-    logging.info("Received task: %s", request.task)
+def execute_task(request: TaskRequest, response: Response, idempotency_key: str = Header(default=None)):
+    result = run_task(request, idempotency_key)
+    # Lets the gateway count failures without parsing the body
+    if isinstance(result, dict) and "error" in result:
+        response.headers["X-Agent-Error"] = "true"
+    return result
+
+def run_task(request, idempotency_key):
+    log_payload("task", "Received task: %s", request.task)
     
     try:
         # Step 1: Always retrieve relevant documents first
-        relevant_docs = search_docs(request.task)
+        session = SESSIONS.get(request.session_id) if request.session_id else None
+        doc_ids = session_doc_ids(CORPUS, request.task, session) if session else CORPUS.search_doc_ids(request.task)
+        relevant_docs = [CORPUS.docs[i] for i in doc_ids]
         
         # Step 2: Generate answer using retrieved context
-        answer = generate_answer(request.task, relevant_docs)
+        answer = generate_answer(PROMPT, request.task, relevant_docs, session.history() if session else "")
+        if session:
+            session.remember(request.task, answer, doc_ids)
+        
+        sources = CORPUS.source_fields(doc_ids, relevant_docs, request.source_format)
         
         # Step 3: Detect intent (information vs action)
-        intent = detect_intent(request.task)
+        with timed("intent"):
+            intent = detect_intent(request.task)
         
-        logging.info(f"Intent detected: {intent}")
+        logging.debug("Intent detected: %s", intent)
         
         # Step 4: Handle based on intent and topic
         query_lower = request.task.lower()
@@ -323,14 +206,14 @@ def execute_task(request: TaskRequest):
         # Action-based requests
         if intent == "action":
             if "leave" in query_lower:
-                return process_leave_action(request.task, answer, relevant_docs)
+                return process_leave_action(request.task, answer, sources, idempotency_key)
             elif "onboard" in query_lower:
-                return process_onboarding_action(request.task, answer, relevant_docs)
+                return process_onboarding_action(request.task, answer, sources, idempotency_key)
         
         # Information-based requests (default)
         return {
             "result": answer,
-            "source_document": "\n".join(relevant_docs) if relevant_docs else "",
+            **sources,
             "intent_detected": intent
         }
 
@@ -1,25 +1,28 @@
-import requests
 import os
+import re
 import logging
-from fastapi import FastAPI
+import requests
+from fastapi import Header, Response
+from typing import Optional
 from pydantic import BaseModel
-import faiss
-import re
-import numpy as np
-from langchain_community.chat_models import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from dotenv import load_dotenv
-from openai import OpenAI
+from agent_common.logs import DroppingQueueHandler, log_payload
+from agent_common.metrics import timed
+from agent_common.tracing import traced
+from agent_common.retrieval import Corpus
+from agent_common.cascade import generate_answer
+from agent_common.sap import post_to_sap
+from agent_common.action_queue import ACTION_QUEUE_MODE, bulk_response, enqueue_sap_action
+from agent_common.sessions import SESSIONS, session_doc_ids
+from agent_common.server import create_app
 
 # -------------------------------------------------
-# Configure logging
+# Load Procurement reference documents and embeddings
 # -------------------------------------------------
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s"
-)
+DOMAIN = "procurement"  # this agent's domain at the gateway (/workflow/procurement/...)
+CORPUS = Corpus(DOMAIN, "Procurement", os.path.join(os.path.dirname(__file__), "procurement_docs.txt"))
 
-app = FastAPI()
+app = create_app("procurement-agent", CORPUS)
 
 def test_health_endpoint():
     # Automated testing for health
@@ -27,112 +30,19 @@ def test_health_endpoint():
     assert response.status_code == 200
     assert response.json() == {"status": "ok"}
 
-
-
-# -------------------------------------------------
-# OpenAI Embedding Function (replacing HuggingFace)
-# -------------------------------------------------
-def get_openai_embedding(texts):
-    """Use OpenAI embeddings instead of HuggingFace"""
-    try:
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        
-        if isinstance(texts, str):
-            texts = [texts]
-            
-        response = client.embeddings.create(
-            input=texts,
-            model="text-embedding-ada-002"
-        )
-        
-        embeddings = [item.embedding for item in response.data]
-        return np.array(embeddings)
-        
-    except Exception as e:
-        logging.error(f"OpenAI embedding error: {e}")
-        raise
-
-# -------------------------------------------------
-# Load Procurement reference documents and embeddings
-# -------------------------------------------------
-try:
-    DOC_PATH = os.path.join(os.path.dirname(__file__), "procurement_docs.txt")
-    with open(DOC_PATH, "r") as f:
-        PROCUREMENT_DOCS = [line.strip() for line in f if line.strip()]
-    
-    logging.info(f"Loaded {len(PROCUREMENT_DOCS)} Procurement document lines from {DOC_PATH}")
-    logging.info(f"First document: {PROCUREMENT_DOCS[0] if PROCUREMENT_DOCS else 'NONE'}")
-    
-    PROC_EMB = get_openai_embedding(PROCUREMENT_DOCS)
-    INDEX = faiss.IndexFlatL2(PROC_EMB.shape[1])
-    INDEX.add(PROC_EMB)
-    logging.info(f"Successfully created embeddings and index with OpenAI")
-    
-except Exception as e:
-    logging.error("Failed to load Procurement docs or embeddings: %s", e)
-    logging.error(f"Current working directory: {os.getcwd()}")
-    logging.error(f"Files in current directory: {os.listdir('.')}")
-    PROCUREMENT_DOCS = []
-    INDEX = None
-
-def search_docs(query, top_k=3):
-    """Search for relevant Procurement documents"""
-    try:
-        if INDEX is None or len(PROCUREMENT_DOCS) == 0:
-            logging.warning("No Procurement documents available for search")
-            return []
-            
-        q_emb = get_openai_embedding([query])
-        D, I = INDEX.search(q_emb, top_k)
-        results = [PROCUREMENT_DOCS[i] for i in I[0] if i < len(PROCUREMENT_DOCS)]
-        
-        # Debug logging
-        logging.info(f"Search query: {query}")
-        logging.info(f"Found {len(results)} relevant documents")
-        for i, doc in enumerate(results):
-            logging.info(f"Doc {i}: {doc[:100]}...")
-            
-        return results
-    except Exception as e:
-        logging.error("Error searching Procurement docs: %s", e)
-        return []
-
 # -------------------------------------------------
-# Load environment variables and LLM
+# Procurement prompt and SAP endpoints
 # -------------------------------------------------
-load_dotenv()
-
-llm = ChatOpenAI(
-    model="gpt-3.5-turbo",
-    openai_api_key=os.getenv("OPENAI_API_KEY")
-)
+PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are an expert Procurement assistant for this company. 
+    Use ONLY the provided company Procurement documents to answer questions accurately. 
+    If the information is not in the documents, say so clearly.
+    Be specific and cite the exact information from the documents."""),
+    ("human", "Company Procurement Documents:\n{context}\n\n{history}Question: {question}\n\nAnswer based on the company documents:")
+])
 
 SAP_API_URL = os.getenv("SAP_API_URL", "")
-
-def get_sap_token():
-    """Fetch OAuth2 token from SAP BTP service key credentials."""
-    token_url = os.getenv("SAP_TOKEN_URL")
-    client_id = os.getenv("SAP_CLIENT_ID")
-    client_secret = os.getenv("SAP_CLIENT_SECRET")
-
-    if not all([token_url, client_id, client_secret]):
-        msg = "Missing SAP OAuth2 credentials in .env"
-        logging.error(msg)
-        raise RuntimeError(msg)
-
-    try:
-        resp = requests.post(
-            token_url,
-            data={'grant_type': 'client_credentials'},
-            auth=(client_id, client_secret)
-        )
-        resp.raise_for_status()
-        token = resp.json().get("access_token")
-        logging.info("SAP token retrieved successfully.")
-        return token
-    except Exception as e:
-        logging.error("Error fetching SAP token: %s", e)
-        raise
+SAP_BATCH_ENTITY_SET = os.getenv("SAP_BATCH_ENTITY_SET", "PurchaseOrders")
 
 def detect_intent(query: str):
     """Detect if query is informational or action-based"""
@@ -159,35 +69,6 @@ def detect_intent(query: str):
         # Default to information for safety
         return "information"
 
-def generate_answer(query, context_docs):
-    """Generate answer using retrieved documents as context"""
-    try:
-        if not context_docs:
-            context = "No relevant company documents found."
-        else:
-            context = "\n\n".join(context_docs)
-        
-        # Debug logging
-        logging.info(f"Context being sent to LLM: {context[:300]}...")
-        
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an expert Procurement assistant for this company. 
-            Use ONLY the provided company Procurement documents to answer questions accurately. 
-            If the information is not in the documents, say so clearly.
-            Be specific and cite the exact information from the documents."""),
-            ("human", "Company Procurement Documents:\n{context}\n\nQuestion: {question}\n\nAnswer based on the company documents:")
-        ])
-        
-        response = llm.invoke(prompt.format_messages(question=query, context=context))
-        
-        # Debug logging
-        logging.info(f"LLM response: {response.content[:200]}...")
-        
-        return response.content
-    except Exception as e:
-        logging.error("Error generating LLM answer: %s", e)
-        return "Error generating answer."
-
 def parse_order_details(task_text):
     """Helper: Dynamic product & quantity parser"""
     pattern = r'order(?: for)? (\d+)\s+([a-zA-Z]+)'
@@ -200,7 +81,37 @@ def parse_order_details(task_text):
         # Default values if nothing matches
         return "Laptop", 10
 
-def process_procurement_action(query, context_answer, context_docs):
+def parse_order_items(task_text):
+    """Helper: the items of an explicit list order ("5 laptops, 10 monitors and 25 keyboards").
+
+    Everything from the first number on must be "<quantity> <product>" entries separated by
+    commas, "and" or newlines; anything else ("5 monitors, delivery within 2 weeks") returns []
+    so the order goes through the single-item path instead of inventing extra lines.
+    """
+    text = task_text.lower()
+    first = re.search(r'\d', text)
+    if not first:
+        return []
+    items = []
+    for entry in re.split(r',|\band\b|\n', text[first.start():]):
+        entry = entry.strip().rstrip(".!?")
+        if not entry:
+            continue
+        match = re.fullmatch(r'(\d+)\s+([a-z]+)', entry)
+        if not match:
+            return []
+        items.append({"product": match.group(2).capitalize(), "quantity": int(match.group(1))})
+    return items
+
+@traced("process_bulk_procurement_action")
+def process_bulk_procurement_action(query, context_answer, sources, order_items, idempotency_key=None):
+    """Process a multi-item order as one OData $batch submission"""
+    return bulk_response(
+        DOMAIN, context_answer, sources, "procurement_order", SAP_BATCH_ENTITY_SET, order_items, idempotency_key
+    )
+
+@traced("process_procurement_action")
+def process_procurement_action(query, context_answer, sources, idempotency_key=None):
     """Process procurement order action with SAP API call"""
     product, quantity = parse_order_details(query)
     
@@ -209,26 +120,21 @@ def process_procurement_action(query, context_answer, context_docs):
         "quantity": quantity
     }
     
+    if ACTION_QUEUE_MODE:
+        return enqueue_sap_action(
+            DOMAIN, "procurement_order", SAP_API_URL, payload, context_answer, sources, idempotency_key,
+            extra={"order_details": {"product": product, "quantity": quantity}}
+        )
+
     try:
-        token = get_sap_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
         logging.info("Sending procurement request to SAP: %s", SAP_API_URL)
-        sap_resp = requests.post(SAP_API_URL, json=payload, headers=headers)
-        sap_status = sap_resp.status_code
-
-        if sap_resp.headers.get("Content-Type", "").startswith("application/json"):
-            sap_result = sap_resp.json()
-        else:
-            sap_result = sap_resp.text
+        sap_status, sap_result = post_to_sap(SAP_API_URL, payload)
 
         logging.info("SAP Procurement API Response Status: %s", sap_status)
         
         return {
             "result": context_answer,
-            "source_document": "\n".join(context_docs) if context_docs else "",
+            **sources,
             "sap_api_status": sap_status,
             "sap_api_result": sap_result,
             "action_performed": "procurement_order_submitted",
@@ -242,7 +148,7 @@ def process_procurement_action(query, context_answer, context_docs):
         
         return {
             "result": context_answer,
-            "source_document": "\n".join(context_docs) if context_docs else "",
+            **sources,
             "sap_api_status": sap_status,
             "sap_api_result": sap_result,
             "action_performed": "procurement_order_failed",
@@ -254,13 +160,21 @@ def process_procurement_action(query, context_answer, context_docs):
 # -------------------------------------------------
 class TaskRequest(BaseModel):
     task: str
+    source_format: str = "text"  # 'text' or 'ids'
+    session_id: Optional[str] = None  # optional; follow-ups in the same session reuse retrieval and history
+
+class BulkRequest(BaseModel):
+    items: list[dict]
 
 # -------------------------------------------------
-# Health check endpoint
+# Bulk endpoint: many purchase orders in one OData $batch
 # -------------------------------------------------
-@app.get("/health")
-def health_check():
-    return {"status": "ok"}
+@app.post("/bulk")
+def execute_bulk(request: BulkRequest, idempotency_key: str = Header(default=None)):
+    return bulk_response(
+        DOMAIN, f"Bulk submission of {len(request.items)} purchase orders", {"source_document": ""},
+        "procurement_order", SAP_BATCH_ENTITY_SET, request.items, idempotency_key
+    )
 
 # -------------------------------------------------
 # Debug endpoint
@@ -270,29 +184,45 @@ def debug_info():
     return {
         "message": "PROCUREMENT AGENT WITH OPENAI EMBEDDINGS",
         "timestamp": "2025-08-21-9:23PM",
-        "procurement_docs_count": len(PROCUREMENT_DOCS),
-        "sample_procurement_doc": PROCUREMENT_DOCS[0] if PROCUREMENT_DOCS else "NO DOCS LOADED",
-        "index_status": "LOADED" if INDEX is not None else "NOT LOADED"
+        "procurement_docs_count": len(CORPUS.docs),
+        "sample_procurement_doc": CORPUS.docs[0] if CORPUS.docs else "NO DOCS LOADED",
+        "index_status": "LOADED" if CORPUS.index is not None else "NOT LOADED",
+        "corpus_version": CORPUS.version,
+        "log_records_dropped": DroppingQueueHandler.dropped
     }
 
 # -------------------------------------------------
 # Main endpoint for Procurement tasks
 # -------------------------------------------------
 @app.post("/task")
-def execute_task(request: TaskRequest):
-    logging.info("Received task: %s", request.task)
+def execute_task(request: TaskRequest, response: Response, idempotency_key: str = Header(default=None)):
+    result = run_task(request, idempotency_key)
+    # Lets the gateway count failures without parsing the body
+    if isinstance(result, dict) and "error" in result:
+        response.headers["X-Agent-Error"] = "true"
+    return result
+
+def run_task(request, idempotency_key):
+    log_payload("task", "Received task: %s", request.task)
     
     try:
         # Step 1: Always retrieve relevant documents first
-        relevant_docs = search_docs(request.task)
+        session = SESSIONS.get(request.session_id) if request.session_id else None
+        doc_ids = session_doc_ids(CORPUS, request.task, session) if session else CORPUS.search_doc_ids(request.task)
+        relevant_docs = [CORPUS.docs[i] for i in doc_ids]
         
         # Step 2: Generate answer using retrieved context
-        answer = generate_answer(request.task, relevant_docs)
+        answer = generate_answer(PROMPT, request.task, relevant_docs, session.history() if session else "")
+        if session:
+            session.remember(request.task, answer, doc_ids)
+        
+        sources = CORPUS.source_fields(doc_ids, relevant_docs, request.source_format)
         
         # Step 3: Detect intent (information vs action)
-        intent = detect_intent(request.task)
+        with timed("intent"):
+            intent = detect_intent(request.task)
         
-        logging.info(f"Intent detected: {intent}")
+        logging.debug("Intent detected: %s", intent)
         
         # Step 4: Handle based on intent and topic
         query_lower = request.task.lower()
@@ -300,13 +230,18 @@ def execute_task(request: TaskRequest):
         # Action-based requests
         if intent == "action":
             if "order" in query_lower or "purchase" in query_lower or "buy" in query_lower:
-                return process_procurement_action(request.task, answer, relevant_docs)
+                order_items = parse_order_items(request.task)
+                if len(order_items) > 1:
+                    return process_bulk_procurement_action(
+                        request.task, answer, sources, order_items, idempotency_key
+                    )
+                return process_procurement_action(request.task, answer, sources, idempotency_key)
             # Add more procurement actions here as needed
         
         # Information-based requests (default)
         return {
             "result": answer,
-            "source_document": "\n".join(relevant_docs) if relevant_docs else "",
+            **sources,
             "intent_detected": intent
         }
 
@@ -315,4 +250,4 @@ def execute_task(request: TaskRequest):
         return {
             "error": str(e),
             "message": "Internal server error during Procurement task processing."
-        }
+        }
\ No newline at end of file
@@ -1,8 +1,29 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
+from typing import Optional
 from pydantic import BaseModel
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from contextlib import contextmanager
+import asyncio
+import collections
+import contextvars
+import gzip
+import hashlib
+import heapq
+import itertools
 import httpx
+import math
+import json
+import logging
 import os
+import queue
+import random
+import re
+import secrets
+import threading
+import time
 app = FastAPI()
 
 app.add_middleware(
@@ -10,36 +31,865 @@ app.add_middleware(
     allow_origins=["*"],  # For dev - allows all origins
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=["Server-Timing", "traceparent", "ETag", "X-Cache", "X-Corpus-Version"]
 )
+# Compresses cached answers and other gateway-built responses; agent bodies that arrive gzipped pass through as-is
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1024")))
+
+STAGE_LATENCY = Histogram(
+    "gateway_stage_seconds", "Latency of each gateway stage", ["stage", "domain"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+REQUESTS_IN_FLIGHT = Gauge("gateway_requests_in_flight", "Workflow requests currently in flight", ["domain"])
+CACHE_REQUESTS = Counter("gateway_cache_requests_total", "Cache lookups by cache and result", ["cache", "result"])
+
+SERVER_TIMING = contextvars.ContextVar("server_timing", default=None)
+
+@contextmanager
+def timed(stage, domain):
+    """Record a stage in the latency histogram and the request's Server-Timing header"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.labels(stage, domain).observe(elapsed)
+        timings = SERVER_TIMING.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    timings = []
+    token = SERVER_TIMING.set(timings)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        SERVER_TIMING.reset(token)
+    timings.append(("gateway", time.perf_counter() - start))
+    # Keep the agent's stage breakdown (copied from the upstream response) after ours
+    entries = [f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in timings]
+    if response.headers.get("Server-Timing"):
+        entries.append(response.headers["Server-Timing"])
+    response.headers["Server-Timing"] = ", ".join(entries)
+    return response
+
+# Same span model as src/agents/agent_common/tracing.py. The gateway is pushed on its
+# own from src/api and does not install the agents' dependencies, so it keeps this copy.
+SERVICE_NAME = os.getenv("SERVICE_NAME", "gateway")
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", "0.1"))
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE", "")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+CURRENT_SPAN = contextvars.ContextVar("current_span", default=None)
+SPAN_EXPORT_QUEUE = queue.Queue(maxsize=10000)
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, sampled, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def end(self):
+        if not self.sampled or not (TRACE_EXPORT_FILE or TRACE_OTLP_ENDPOINT):
+            return
+        try:
+            SPAN_EXPORT_QUEUE.put_nowait({
+                "service": SERVICE_NAME,
+                "name": self.name,
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "start_ns": self.start_ns,
+                "end_ns": time.time_ns(),
+                "attributes": self.attributes
+            })
+        except queue.Full:
+            pass  # Drop spans rather than slow down requests
+
+def start_trace(name, traceparent=None):
+    """Continue the caller's trace if a valid traceparent was sent, otherwise start a sampled-or-not new one"""
+    match = TRACEPARENT_RE.match(traceparent or "")
+    if match and match.group(1) != "0" * 32:
+        return Span(name, match.group(1), match.group(2), match.group(3) == "01")
+    return Span(name, secrets.token_hex(16), None, random.random() < TRACE_SAMPLE_RATIO)
+
+@contextmanager
+def span(name, **attributes):
+    parent = CURRENT_SPAN.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, parent.trace_id, parent.span_id, parent.sampled, attributes)
+    token = CURRENT_SPAN.set(child)
+    try:
+        yield child
+    except Exception as e:
+        child.attributes["error"] = str(e)
+        raise
+    finally:
+        CURRENT_SPAN.reset(token)
+        child.end()
+
+def trace_headers():
+    """Headers that carry the current trace to an outbound call"""
+    current = CURRENT_SPAN.get()
+    return {"traceparent": current.traceparent()} if current else {}
+
+def export_spans():
+    while True:
+        batch = [SPAN_EXPORT_QUEUE.get()]
+        while len(batch) < 512:
+            try:
+                batch.append(SPAN_EXPORT_QUEUE.get(timeout=1.0))
+            except queue.Empty:
+                break
+        try:
+            if TRACE_EXPORT_FILE:
+                with open(TRACE_EXPORT_FILE, "a") as f:
+                    f.writelines(json.dumps(item) + "\n" for item in batch)
+            if TRACE_OTLP_ENDPOINT:
+                httpx.post(TRACE_OTLP_ENDPOINT, json=to_otlp(batch), timeout=5)
+        except Exception as e:
+            logging.warning("Span export failed: %s", e)
+
+def to_otlp(batch):
+    """Convert exported spans to an OTLP/HTTP JSON payload"""
+    spans = [{
+        "traceId": item["trace_id"],
+        "spanId": item["span_id"],
+        "parentSpanId": item["parent_id"] or "",
+        "name": item["name"],
+        "startTimeUnixNano": str(item["start_ns"]),
+        "endTimeUnixNano": str(item["end_ns"]),
+        "attributes": [{"key": k, "value": {"stringValue": str(v)}} for k, v in item["attributes"].items()]
+    } for item in batch]
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}]
+    }]}
+
+if TRACE_EXPORT_FILE or TRACE_OTLP_ENDPOINT:
+    threading.Thread(target=export_spans, daemon=True).start()
+
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    if request.url.path in ("/health", "/metrics"):
+        return await call_next(request)
+    root = start_trace(f"{request.method} {request.url.path}", request.headers.get("traceparent"))
+    token = CURRENT_SPAN.set(root)
+    try:
+        response = await call_next(request)
+        root.attributes["http.status_code"] = response.status_code
+    finally:
+        CURRENT_SPAN.reset(token)
+        root.end()
+    response.headers["traceparent"] = root.traceparent()
+    return response
+
+DEFAULT_AGENT_URLS = {
+    "hr": "https://hr-agent-fearless-gorilla-qc.cfapps.us10-001.hana.ondemand.com",
+    "finance": "https://finance-agent-unexpected-camel-xm.cfapps.us10-001.hana.ondemand.com",
+    "procurement": "https://procurement-agent-bold-pangolin-za.cfapps.us10-001.hana.ondemand.com",
+}
+UPSTREAMS_FILE = os.getenv("UPSTREAMS_FILE", "")
+UPSTREAMS_RELOAD_S = float(os.getenv("UPSTREAMS_RELOAD_S", "5"))
+HEALTH_CHECK_INTERVAL_S = float(os.getenv("HEALTH_CHECK_INTERVAL_S", "10"))  # 0 disables active checks
+HEALTH_CHECK_TIMEOUT_S = float(os.getenv("HEALTH_CHECK_TIMEOUT_S", "2"))
+HEALTH_CHECK_FAILURES = int(os.getenv("HEALTH_CHECK_FAILURES", "2"))
+LB_STRATEGY = os.getenv("LB_STRATEGY", "least_outstanding")  # "least_outstanding" or "ewma"
+LB_EWMA_ALPHA = float(os.getenv("LB_EWMA_ALPHA", "0.3"))
+
+def load_upstream_config():
+    """Agent URLs per domain from UPSTREAMS_FILE ({"hr": ["http://...", ...]}) or <DOMAIN>_AGENT_URLS"""
+    if UPSTREAMS_FILE:
+        with open(UPSTREAMS_FILE) as f:
+            config = json.load(f)
+        return {domain: [url.rstrip("/") for url in urls] for domain, urls in config.items()}
+    config = {}
+    for domain, default_url in DEFAULT_AGENT_URLS.items():
+        urls = os.getenv(f"{domain.upper()}_AGENT_URLS") or os.getenv(f"{domain.upper()}_AGENT_URL", default_url)
+        config[domain] = [url.strip().rstrip("/") for url in urls.split(",") if url.strip()]
+    return config
+
+UPSTREAM_TIMEOUT_S = float(os.getenv("UPSTREAM_TIMEOUT_S", "30"))
+UPSTREAM_TIMEOUT_MIN_S = float(os.getenv("UPSTREAM_TIMEOUT_MIN_S", "2"))
+UPSTREAM_TIMEOUT_MULTIPLIER = float(os.getenv("UPSTREAM_TIMEOUT_MULTIPLIER", "3"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT_S = float(os.getenv("BREAKER_RESET_TIMEOUT_S", "30"))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "1"))
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_MIN_DELAY_S = float(os.getenv("HEDGE_MIN_DELAY_S", "0.5"))
+
+BREAKER_STATE = Gauge(
+    "gateway_breaker_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)", ["domain", "upstream"]
+)
+UPSTREAM_HEALTHY = Gauge("gateway_upstream_healthy", "Result of the last active health check", ["domain", "upstream"])
+HEDGED_REQUESTS = Counter("gateway_hedged_requests_total", "Hedged upstream attempts by outcome", ["domain", "outcome"])
+
+class CircuitBreaker:
+    """Opens after consecutive failures; after a cool-down lets a few half-open probes through"""
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(self, domain, url):
+        self.domain = domain
+        self.url = url
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.set_state("closed")
+
+    def set_state(self, state):
+        self.state = state
+        BREAKER_STATE.labels(self.domain, self.url).set(self.STATES[state])
+
+    def allow(self):
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < BREAKER_RESET_TIMEOUT_S:
+                return False
+            self.set_state("half_open")
+            self.probes = 0
+        if self.state == "half_open":
+            if self.probes >= BREAKER_HALF_OPEN_PROBES:
+                # A probe that lost a hedge race never reports back; re-arm after another cool-down
+                if time.monotonic() - self.opened_at < 2 * BREAKER_RESET_TIMEOUT_S:
+                    return False
+                self.opened_at = time.monotonic() - BREAKER_RESET_TIMEOUT_S
+                self.probes = 0
+            self.probes += 1
+        return True
+
+    def retry_after(self):
+        return max(1, math.ceil(BREAKER_RESET_TIMEOUT_S - (time.monotonic() - self.opened_at)))
+
+    def record_success(self):
+        self.failures = 0
+        if self.state != "closed":
+            self.set_state("closed")
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= BREAKER_FAILURE_THRESHOLD:
+            self.opened_at = time.monotonic()
+            self.set_state("open")
+
+class LatencyTracker:
+    """Recent successful informational upstream latencies, used for their timeouts and hedge delays"""
+    def __init__(self, size=200):
+        self.samples = collections.deque(maxlen=size)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, pct):
+        if len(self.samples) < 20:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def timeout(self):
+        p99 = self.percentile(99)
+        if p99 is None:
+            return UPSTREAM_TIMEOUT_S
+        return min(UPSTREAM_TIMEOUT_S, max(UPSTREAM_TIMEOUT_MIN_S, p99 * UPSTREAM_TIMEOUT_MULTIPLIER))
+
+    def hedge_delay(self):
+        p95 = self.percentile(95)
+        return max(HEDGE_MIN_DELAY_S, p95) if p95 is not None else None
+
+class Upstream:
+    """One agent instance: requests in flight, latency EWMA, health and its own circuit breaker"""
+    def __init__(self, domain, url):
+        self.domain = domain
+        self.url = url
+        self.outstanding = 0
+        self.ewma_s = None
+        self.healthy = True
+        self.check_failures = 0
+        self.breaker = CircuitBreaker(domain, url)
+        UPSTREAM_HEALTHY.labels(domain, url).set(1)
+
+    def record_latency(self, seconds):
+        self.ewma_s = seconds if self.ewma_s is None else LB_EWMA_ALPHA * seconds + (1 - LB_EWMA_ALPHA) * self.ewma_s
+
+    def load(self):
+        if LB_STRATEGY == "ewma":
+            # Expected wait: the latency estimate scaled by the requests already queued on it
+            return (self.outstanding + 1) * (self.ewma_s or 0.0)
+        return self.outstanding
+
+class UpstreamRegistry:
+    def __init__(self):
+        self.upstreams = {}  # domain -> [Upstream]
+
+    def configure(self, config):
+        """Swap in a new endpoint list, keeping the state of endpoints that did not change"""
+        current = {(u.domain, u.url): u for upstreams in self.upstreams.values() for u in upstreams}
+        self.upstreams = {
+            domain: [current.get((domain, url)) or Upstream(domain, url) for url in dict.fromkeys(urls)]
+            for domain, urls in config.items() if urls
+        }
+        kept = {(u.domain, u.url) for upstreams in self.upstreams.values() for u in upstreams}
+        for labels in current.keys() - kept:
+            UPSTREAM_HEALTHY.remove(*labels)
+            BREAKER_STATE.remove(*labels)
+
+    def all(self):
+        return [u for upstreams in self.upstreams.values() for u in upstreams]
+
+    def pick(self, domain, exclude=(), affinity=None):
+        """Least-loaded healthy endpoint whose breaker lets the request through.
+
+        With an affinity key (a session id) the order is a rendezvous hash instead, so a
+        conversation stays on the replica that holds its history and only moves when that
+        replica is excluded, unhealthy or removed.
+        """
+        candidates = [u for u in self.upstreams.get(domain, []) if u not in exclude]
+        # If every endpoint failed its health check, let the breakers decide instead of refusing outright
+        pool = [u for u in candidates if u.healthy] or candidates
+        if affinity:
+            order = sorted(pool, key=lambda u: hashlib.sha256(f"{affinity}|{u.url}".encode()).digest())
+        else:
+            random.shuffle(pool)  # break ties between equally loaded endpoints
+            order = sorted(pool, key=Upstream.load)
+        for upstream in order:
+            if upstream.breaker.allow():
+                return upstream
+        return None
+
+    def pick_hedge(self, domain, exclude):
+        """Another healthy replica for a hedge; never a half-open one, whose probe slot it would take"""
+        candidates = [
+            u for u in self.upstreams.get(domain, [])
+            if u not in exclude and u.healthy and u.breaker.state == "closed"
+        ]
+        return min(candidates, key=Upstream.load, default=None)
+
+    def retry_after(self, domain):
+        return min((u.breaker.retry_after() for u in self.upstreams.get(domain, [])), default=1)
+
+REGISTRY = UpstreamRegistry()
+LATENCIES = {}
+
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "32"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "64"))
+ADMISSION_WAIT_S = {
+    "interactive": float(os.getenv("ADMISSION_WAIT_INTERACTIVE_S", "2")),
+    "batch": float(os.getenv("ADMISSION_WAIT_BATCH_S", "30")),
+}
+# Lower rank is admitted first: interactive before batch, then questions before SAP actions
+PRIORITY_RANKS = {
+    ("interactive", "information"): 0,
+    ("interactive", "action"): 1,
+    ("batch", "action"): 2,
+    ("batch", "information"): 3,
+}
+
+ADMISSION_REJECTED = Counter(
+    "gateway_admission_rejected_total", "Workflow requests shed by admission control", ["domain", "priority", "reason"]
+)
+ADMISSION_QUEUE_DEPTH = Gauge("gateway_admission_queue_depth", "Requests waiting for an upstream slot", ["domain"])
+
+class Overloaded(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+class AdmissionController:
+    """Per-domain concurrency limit with a bounded priority queue; the lowest-priority waiter is shed first"""
+    def __init__(self, domain):
+        self.domain = domain
+        self.in_flight = 0
+        self.waiters = []  # heap of (rank, seq, future)
+        self.seq = itertools.count()
+
+    async def acquire(self, rank, wait_s):
+        if self.in_flight < ADMISSION_MAX_CONCURRENCY and not self.waiters:
+            self.in_flight += 1
+            return
+        if len(self.waiters) >= ADMISSION_QUEUE_SIZE:
+            worst = max(self.waiters)
+            if rank >= worst[0]:
+                raise Overloaded("queue_full")
+            self.waiters.remove(worst)
+            heapq.heapify(self.waiters)
+            worst[2].set_exception(Overloaded("evicted"))
+        future = asyncio.get_running_loop().create_future()
+        entry = (rank, next(self.seq), future)
+        heapq.heappush(self.waiters, entry)
+        ADMISSION_QUEUE_DEPTH.labels(self.domain).set(len(self.waiters))
+        try:
+            # The slot is handed over by release(), so in_flight is already counted for us
+            await asyncio.wait_for(future, timeout=wait_s)
+        except asyncio.TimeoutError:
+            raise Overloaded("timeout")
+        finally:
+            if entry in self.waiters:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+            ADMISSION_QUEUE_DEPTH.labels(self.domain).set(len(self.waiters))
+
+    def release(self):
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def retry_after(self):
+        """Rough time for the current queue to drain through the available slots"""
+        p50 = LATENCIES[self.domain].percentile(50) or 1.0
+        return max(1, math.ceil((len(self.waiters) + 1) / ADMISSION_MAX_CONCURRENCY * p50))
+
+ADMISSION = {}
+
+def apply_upstream_config(config):
+    REGISTRY.configure(config)
+    for domain in REGISTRY.upstreams:
+        LATENCIES.setdefault(domain, LatencyTracker())
+        ADMISSION.setdefault(domain, AdmissionController(domain))
+
+apply_upstream_config(load_upstream_config())
+
+# One pooled client for all upstream calls instead of a new connection per request. The pool
+# holds every request admission lets through (twice over with hedging) plus the health checks,
+# so waiting for a free connection, which counts against the request timeout, stays rare.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "0")) or (
+    ADMISSION_MAX_CONCURRENCY * len(REGISTRY.upstreams) * (2 if HEDGE_ENABLED else 1) + len(REGISTRY.all()) + 16
+)
+HTTP_CLIENT = httpx.AsyncClient(
+    timeout=UPSTREAM_TIMEOUT_S,
+    limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE)
+)
+
+@app.on_event("shutdown")
+async def close_http_client():
+    for task in BACKGROUND_TASKS:
+        task.cancel()
+    await HTTP_CLIENT.aclose()
+
+async def check_upstream(upstream):
+    """Healthy means /health answers and the agent's document index is loaded"""
+    try:
+        health = await HTTP_CLIENT.get(f"{upstream.url}/health", timeout=HEALTH_CHECK_TIMEOUT_S)
+        debug = await HTTP_CLIENT.get(f"{upstream.url}/debug", timeout=HEALTH_CHECK_TIMEOUT_S)
+        ok = health.status_code == 200 and debug.status_code == 200 and debug.json().get("index_status") == "LOADED"
+        if ok:
+            # Hot questions never miss the response cache, so a new corpus has to be noticed here
+            update_corpus_version(upstream.domain, debug.json().get("corpus_version"))
+    except (httpx.HTTPError, ValueError):
+        ok = False
+    upstream.check_failures = 0 if ok else upstream.check_failures + 1
+    healthy = upstream.check_failures < HEALTH_CHECK_FAILURES
+    if healthy != upstream.healthy:
+        logging.warning("Upstream %s for %s is now %s", upstream.url, upstream.domain, "healthy" if healthy else "unhealthy")
+    upstream.healthy = healthy
+    UPSTREAM_HEALTHY.labels(upstream.domain, upstream.url).set(1 if healthy else 0)
+
+async def health_check_loop():
+    while True:
+        await asyncio.gather(*(check_upstream(upstream) for upstream in REGISTRY.all()))
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL_S)
+
+async def reload_upstreams_loop():
+    """Pick up edits to UPSTREAMS_FILE without a restart"""
+    mtime = os.stat(UPSTREAMS_FILE).st_mtime_ns
+    while True:
+        await asyncio.sleep(UPSTREAMS_RELOAD_S)
+        try:
+            current = os.stat(UPSTREAMS_FILE).st_mtime_ns
+            if current == mtime:
+                continue
+            apply_upstream_config(load_upstream_config())
+            mtime = current
+            logging.warning("Reloaded upstreams from %s: %s", UPSTREAMS_FILE,
+                            {domain: len(upstreams) for domain, upstreams in REGISTRY.upstreams.items()})
+        except (OSError, ValueError) as e:
+            logging.warning("Keeping current upstreams, could not reload %s: %s", UPSTREAMS_FILE, e)
+
+BACKGROUND_TASKS = []
+
+@app.on_event("startup")
+async def start_upstream_monitoring():
+    if HEALTH_CHECK_INTERVAL_S > 0:
+        BACKGROUND_TASKS.append(asyncio.create_task(health_check_loop()))
+    if UPSTREAMS_FILE:
+        BACKGROUND_TASKS.append(asyncio.create_task(reload_upstreams_loop()))
+
+# SAP jobs live in the queue of the replica that accepted them
+JOB_ROUTES = collections.OrderedDict()
+JOB_ROUTES_MAX = 10000
+
+def remember_job_route(domain, job_id, url):
+    JOB_ROUTES[(domain, job_id)] = url
+    while len(JOB_ROUTES) > JOB_ROUTES_MAX:
+        JOB_ROUTES.popitem(last=False)
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))  # 0 disables the cache
+RESPONSE_CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL_S", "300"))
+
+class ResponseCache:
+    """LRU of serialized informational answers keyed by (domain, normalized task, corpus version)"""
+    def __init__(self, max_entries, ttl_s):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.entries = collections.OrderedDict()  # key -> (body, etag, stored_at)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[2] > self.ttl_s:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, body):
+        # Weak: the same answer may go out gzipped or not
+        etag = f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self.entries[key] = (body, etag, time.monotonic())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return etag
+
+    def drop_domain(self, domain):
+        for key in [key for key in self.entries if key[0] == domain]:
+            del self.entries[key]
+
+RESPONSE_CACHE = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_S)
+# Latest X-Corpus-Version seen from each agent; answers cached under an older version are dropped
+CORPUS_VERSIONS = {}
+
+def normalize_task(task):
+    return " ".join(task.lower().split()).rstrip("?!. ")
+
+def response_cache_key(request, version):
+    return request.domain, normalize_task(request.task), request.source_format, version
+
+def update_corpus_version(domain, version):
+    if version and CORPUS_VERSIONS.get(domain) != version:
+        if domain in CORPUS_VERSIONS:
+            logging.info("Corpus version for %s changed to %s; dropping cached answers", domain, version)
+            RESPONSE_CACHE.drop_domain(domain)
+        CORPUS_VERSIONS[domain] = version
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+def accepts_gzip(accept_encoding):
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.partition(";")
+        if coding.strip() in ("gzip", "*") and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            return True
+    return False
+
+def decode_body(headers, body):
+    return gzip.decompress(body) if headers.get("Content-Encoding") == "gzip" else body
+
+ACTION_PATTERNS = [
+    "apply for", "submit", "request", "create", "process",
+    "want to", "need to", "how do i submit", "help me apply",
+    "start", "begin", "initiate", "upload", "send", "order", "purchase", "buy"
+]
+
+def classify_intent(task):
+    """Same keyword rules as the agents' detect_intent: anything action-like is not safe to repeat"""
+    task_lower = task.lower()
+    return "action" if any(pattern in task_lower for pattern in ACTION_PATTERNS) else "information"
+
+class UpstreamStatusError(Exception):
+    def __init__(self, status_code, text):
+        super().__init__(f"Agent returned {status_code}")
+        self.status_code = status_code
+        self.text = text
+
+async def call_agent(upstream, payload, headers, timeout, stream=False):
+    """Returns (upstream, response, raw body); with stream=True a 200 comes back open, with body None"""
+    upstream.outstanding += 1
+    start = time.perf_counter()
+    try:
+        with timed("upstream", upstream.domain), span("upstream", domain=upstream.domain, upstream=upstream.url):
+            request = HTTP_CLIENT.build_request(
+                "POST", f"{upstream.url}/task", json=payload, headers={**trace_headers(), **headers}, timeout=timeout
+            )
+            response = await HTTP_CLIENT.send(request, stream=True)
+            if stream and response.status_code == 200:
+                body = None
+            else:
+                try:
+                    # Raw bytes, still gzipped if the agent compressed them, so they can be passed on untouched
+                    body = b"".join([chunk async for chunk in response.aiter_raw()])
+                finally:
+                    await response.aclose()
+    finally:
+        # The agent has done its work once its headers arrive; only the transfer is left
+        upstream.outstanding -= 1
+    if response.is_error:
+        raise UpstreamStatusError(response.status_code, decode_body(response.headers, body).decode(errors="replace"))
+    upstream.record_latency(time.perf_counter() - start)
+    return upstream, response, body
+
+async def relay_body(response):
+    """Pass an open agent response on as it arrives, still compressed if the agent compressed it"""
+    try:
+        async for chunk in response.aiter_raw():
+            yield chunk
+    finally:
+        await response.aclose()
+
+async def hedged_call_agent(upstream, payload, headers, timeout, delay):
+    """Send a second attempt if the first is slower than the recent p95; first success wins"""
+    domain = upstream.domain
+    primary = asyncio.create_task(call_agent(upstream, payload, headers, timeout))
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+    HEDGED_REQUESTS.labels(domain, "fired").inc()
+    # Prefer another replica so the hedge does not queue behind the slow one
+    hedge_upstream = REGISTRY.pick_hedge(domain, exclude={upstream}) or upstream
+    hedge = asyncio.create_task(call_agent(hedge_upstream, payload, headers, timeout))
+    pending = {primary, hedge}
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for attempt in done:
+            if attempt.exception() is None:
+                for other in pending:
+                    other.cancel()
+                if attempt is hedge:
+                    HEDGED_REQUESTS.labels(domain, "won").inc()
+                return attempt.result()
+    raise primary.exception()
 
 class WorkflowRequest(BaseModel):
     domain: str  # 'hr', 'finance', or 'procurement'
     task: str
+    priority: str = "interactive"  # 'interactive' or 'batch'
+    source_format: str = "text"  # 'text' or 'ids' (document ids and corpus offsets instead of text)
+    session_id: Optional[str] = None  # optional; turns of one conversation go to the same replica
 
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
 
-@app.post("/workflow")
-async def handle_workflow(request: WorkflowRequest):
-    domain_urls = {
-        "hr": "https://hr-agent-fearless-gorilla-qc.cfapps.us10-001.hana.ondemand.com",
-        "finance": "https://finance-agent-unexpected-camel-xm.cfapps.us10-001.hana.ondemand.com",
-        "procurement": "https://procurement-agent-bold-pangolin-za.cfapps.us10-001.hana.ondemand.com",
+@app.get("/metrics")
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/breakers")
+def breaker_status():
+    return {
+        domain: {
+            "p95_s": LATENCIES[domain].percentile(95),
+            "p99_s": LATENCIES[domain].percentile(99),
+            "timeout_s": LATENCIES[domain].timeout(),
+            "upstreams": {
+                u.url: {"state": u.breaker.state, "consecutive_failures": u.breaker.failures} for u in upstreams
+            }
+        }
+        for domain, upstreams in REGISTRY.upstreams.items()
+    }
+
+@app.get("/upstreams")
+def upstream_status():
+    return {
+        domain: [{
+            "url": u.url,
+            "healthy": u.healthy,
+            "outstanding": u.outstanding,
+            "ewma_ms": round(u.ewma_s * 1000, 1) if u.ewma_s is not None else None,
+            "breaker": u.breaker.state
+        } for u in upstreams]
+        for domain, upstreams in REGISTRY.upstreams.items()
     }
-    agent_url = domain_urls.get(request.domain)
-    if not agent_url:
+
+@app.post("/workflow")
+async def handle_workflow(request: WorkflowRequest,
+                          idempotency_key: str = Header(default=None),
+                          if_none_match: str = Header(default=None),
+                          accept_encoding: str = Header(default=None)):
+    if request.domain not in REGISTRY.upstreams:
         raise HTTPException(status_code=400, detail=f"Agent URL for domain {request.domain} is not set")
+    priority = "batch" if request.priority == "batch" else "interactive"
+    request.source_format = "ids" if request.source_format == "ids" else "text"
+    intent = classify_intent(request.task)
+    # Only informational answers are cached; actions always reach the agent, and so does any
+    # session turn, whose answer depends on the conversation and which the agent must record
+    cacheable = intent == "information" and RESPONSE_CACHE_MAX_ENTRIES > 0 and not request.session_id
+    if cacheable and CORPUS_VERSIONS.get(request.domain):
+        with timed("cache", request.domain):
+            cached = RESPONSE_CACHE.get(response_cache_key(request, CORPUS_VERSIONS[request.domain]))
+        CACHE_REQUESTS.labels("response", "hit" if cached else "miss").inc()
+        if cached:
+            body, etag, _ = cached
+            headers = {
+                "ETag": etag,
+                "X-Cache": "hit",
+                "Cache-Control": "private, no-cache",
+                "X-Corpus-Version": CORPUS_VERSIONS[request.domain]
+            }
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers=headers)
+            return Response(content=body, media_type="application/json", headers=headers)
+    admission = ADMISSION[request.domain]
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{agent_url}/task", json={"task": request.task})
-        response.raise_for_status()
-        return response.json()
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=502, detail=f"Could not reach agent: {e}")
-    except httpx.HTTPStatusError as e:
-        raise HTTPException(status_code=502, detail=f"Agent error: {e.response.text}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Orchestrator error: {str(e)}")
+        with timed("admission", request.domain):
+            await admission.acquire(PRIORITY_RANKS[(priority, intent)], ADMISSION_WAIT_S[priority])
+        try:
+            response, failed = await forward_workflow(
+                request, intent, idempotency_key, accepts_gzip(accept_encoding), stream=not cacheable
+            )
+        finally:
+            admission.release()
+    except Overloaded as e:
+        ADMISSION_REJECTED.labels(request.domain, priority, e.reason).inc()
+        raise HTTPException(
+            status_code=429,
+            detail=f"Agent for domain {request.domain} is overloaded ({e.reason})",
+            headers={"Retry-After": str(admission.retry_after())}
+        )
 
+    version = response.headers.get("X-Corpus-Version")
+    if cacheable and version and response.status_code == 200 and not failed:
+        etag = RESPONSE_CACHE.put(response_cache_key(request, version), decode_body(response.headers, response.body))
+        response.headers.update({"ETag": etag, "X-Cache": "miss", "Cache-Control": "private, no-cache"})
+    return response
+
+# Upstream headers the caller sees; the body itself is relayed without being parsed
+PASSTHROUGH_HEADERS = ("Content-Encoding", "Vary", "Server-Timing", "X-Corpus-Version", "X-Agent-Error")
+
+async def forward_workflow(request, intent, idempotency_key, gzip_ok, stream=False):
+    """Call an agent and relay its response bytes; returns the response and whether the agent reported an error.
+
+    With stream=True a 200 is passed on as it arrives instead of being held until complete;
+    answers that are about to be cached, and 202 job responses, are always read in full.
+    """
+    latencies = LATENCIES[request.domain]
+    payload = {"task": request.task, "source_format": request.source_format}
+    if request.session_id:
+        payload["session_id"] = request.session_id
+    forwarded_headers = {"Accept-Encoding": "gzip" if gzip_ok else "identity"}
+    if idempotency_key:
+        forwarded_headers["Idempotency-Key"] = idempotency_key
+    hedge_delay = latencies.hedge_delay()
+    # An action cut off by a tight timeout may still reach SAP; only informational calls get the adaptive one
+    timeout = latencies.timeout() if intent == "information" else UPSTREAM_TIMEOUT_S
+    tried = set()
+    while True:
+        upstream = REGISTRY.pick(request.domain, exclude=tried, affinity=request.session_id)
+        if upstream is None and tried:
+            raise HTTPException(status_code=502, detail=f"Could not reach any agent for domain {request.domain}")
+        if upstream is None:
+            raise HTTPException(
+                status_code=503,
+                detail=f"Agent for domain {request.domain} is unavailable (circuit open)",
+                headers={"Retry-After": str(REGISTRY.retry_after(request.domain))}
+            )
+        tried.add(upstream)
+        start = time.perf_counter()
+        try:
+            with REQUESTS_IN_FLIGHT.labels(request.domain).track_inprogress():
+                # A hedge would record the same turn twice, on two replicas
+                if HEDGE_ENABLED and hedge_delay and intent == "information" and not request.session_id:
+                    upstream, response, body = await hedged_call_agent(
+                        upstream, payload, forwarded_headers, timeout, hedge_delay
+                    )
+                else:
+                    upstream, response, body = await call_agent(
+                        upstream, payload, forwarded_headers, timeout, stream=stream
+                    )
+            break
+        except httpx.ConnectError as e:
+            # The request never reached the agent, so even an action can safely go to another replica
+            upstream.breaker.record_failure()
+            logging.warning("Could not connect to %s, trying another replica: %s", upstream.url, e)
+        except httpx.PoolTimeout:
+            # No free connection in the gateway's own pool: shed the request, the agent is not at fault
+            raise Overloaded("pool_timeout")
+        except httpx.TimeoutException as e:
+            upstream.breaker.record_failure()
+            raise HTTPException(status_code=504, detail=f"Agent timed out: {e}")
+        except httpx.RequestError as e:
+            upstream.breaker.record_failure()
+            raise HTTPException(status_code=502, detail=f"Could not reach agent: {e}")
+        except UpstreamStatusError as e:
+            if e.status_code >= 500:
+                upstream.breaker.record_failure()
+            else:
+                upstream.breaker.record_success()
+            if e.status_code in (409, 422):
+                # The client's request was refused (e.g. an Idempotency-Key reused for another payload)
+                raise HTTPException(status_code=e.status_code, detail=f"Agent rejected the request: {e.text}")
+            raise HTTPException(status_code=502, detail=f"Agent error: {e.text}")
+        except Exception as e:
+            upstream.breaker.record_failure()
+            raise HTTPException(status_code=500, detail=f"Orchestrator error: {str(e)}")
+
+    # Agents report internal failures as a 200 with an "error" field, flagged in X-Agent-Error
+    failed = response.headers.get("X-Agent-Error") == "true"
+    if failed:
+        upstream.breaker.record_failure()
+    else:
+        upstream.breaker.record_success()
+        if intent == "information":
+            latencies.record(time.perf_counter() - start)
+    if response.headers.get("X-Corpus-Version"):
+        update_corpus_version(request.domain, response.headers["X-Corpus-Version"])
+    # 202 means the agent queued the SAP action; the small job body is the only one parsed here
+    if response.status_code == 202:
+        job = json.loads(decode_body(response.headers, body))
+        if isinstance(job, dict) and job.get("job_id"):
+            remember_job_route(request.domain, job["job_id"], upstream.url)
+    headers = {name: response.headers[name] for name in PASSTHROUGH_HEADERS if name in response.headers}
+    if body is None:
+        return StreamingResponse(
+            relay_body(response),
+            status_code=response.status_code,
+            headers=headers,
+            media_type=response.headers.get("Content-Type", "application/json")
+        ), failed
+    return Response(
+        content=body,
+        status_code=response.status_code,
+        headers=headers,
+        media_type=response.headers.get("Content-Type", "application/json")
+    ), failed
+
+@app.get("/workflow/{domain}/jobs/{job_id}")
+async def workflow_job_status(domain: str, job_id: str):
+    if domain not in REGISTRY.upstreams:
+        raise HTTPException(status_code=400, detail=f"Agent URL for domain {domain} is not set")
+    # Ask the replica that queued the job; after a gateway restart, ask each replica in turn
+    known = JOB_ROUTES.get((domain, job_id))
+    urls = [known] if known else [u.url for u in REGISTRY.upstreams[domain]]
+    error = None
+    for url in urls:
+        try:
+            response = await HTTP_CLIENT.get(f"{url}/jobs/{job_id}", headers=trace_headers())
+        except httpx.RequestError as e:
+            error = HTTPException(status_code=502, detail=f"Could not reach agent: {e}")
+            continue
+        if response.status_code == 404:
+            continue
+        if response.status_code >= 400:
+            raise HTTPException(status_code=502, detail=f"Agent error: {response.text}")
+        remember_job_route(domain, job_id, url)
+        return response.json()
+    if error:
+        raise error
+    raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
@@ -0,0 +1,45 @@
+"""Load agent and gateway modules for unit tests, without OpenAI, SAP or a built index.
+
+Importing an agent tries to embed its documents; with the OpenAI base URL pointed at
+a closed port that fails fast and the agent starts with an empty index, which the
+parsing helpers under test do not need.
+"""
+import importlib
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The agents are deployed from src/agents, next to the agent_common package they share
+sys.path.insert(0, os.path.join(ROOT, "src", "agents"))
+
+
+def load_agent(name):
+    os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+    os.environ.setdefault("OPENAI_BASE_URL", "http://127.0.0.1:9")
+    return importlib.import_module(f"{name}_agent.main")
+
+
+def load_gateway():
+    # src/api/main.py is not a package; a name of its own keeps it apart from the agents' main modules
+    spec = importlib.util.spec_from_file_location("gateway_main", os.path.join(ROOT, "src", "api", "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def procurement_agent():
+    return load_agent("procurement")
+
+
+@pytest.fixture(scope="session")
+def finance_agent():
+    return load_agent("finance")
+
+
+@pytest.fixture(scope="session")
+def gateway():
+    return load_gateway()
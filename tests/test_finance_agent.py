@@ -0,0 +1,55 @@
+from datetime import date, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def due(finance_agent):
+    """The due date an invoice gets when its request does not name one"""
+    return (date.today() + timedelta(days=finance_agent.INVOICE_PAYMENT_TERMS_DAYS)).isoformat()
+
+
+def test_parse_invoice_lines_one_per_line(finance_agent, due):
+    task = (
+        "Submit invoices INV-1001 from ACME Supplies for 1250 USD\n"
+        "INV-1002 from Globex for 980.50 EUR due 2025-11-15\n"
+        "INV-1003 from Initech for 4,300 USD"
+    )
+    assert finance_agent.parse_invoice_lines(task) == [
+        {"invoiceNumber": "INV-1001", "vendorName": "ACME Supplies", "amount": 1250.0, "currency": "USD", "dueDate": due},
+        {"invoiceNumber": "INV-1002", "vendorName": "Globex", "amount": 980.5, "currency": "EUR", "dueDate": "2025-11-15"},
+        {"invoiceNumber": "INV-1003", "vendorName": "Initech", "amount": 4300.0, "currency": "USD", "dueDate": due},
+    ]
+
+
+def test_parse_invoice_lines_single_invoice(finance_agent, due):
+    assert finance_agent.parse_invoice_lines("Submit invoice INV-20230815-001 from ACME Supplies for 1250 USD") == [
+        {"invoiceNumber": "INV-20230815-001", "vendorName": "ACME Supplies", "amount": 1250.0, "currency": "USD",
+         "dueDate": due}
+    ]
+
+
+def test_parse_invoice_lines_defaults(finance_agent, due):
+    assert finance_agent.parse_invoice_lines("Pay INV-7 for 99.90") == [
+        {"invoiceNumber": "INV-7", "vendorName": "", "amount": 99.9, "currency": "USD", "dueDate": due}
+    ]
+
+
+def test_parse_invoice_lines_without_invoice_number(finance_agent):
+    assert finance_agent.parse_invoice_lines("Submit an invoice from ACME for 1250 USD") == []
+
+
+def test_invoice_without_vendor_is_not_sent_to_sap(finance_agent, monkeypatch):
+    monkeypatch.setattr(finance_agent.CORPUS, "search_doc_ids", lambda task: [])
+    monkeypatch.setattr(finance_agent, "generate_answer", lambda *args: "Invoices are paid net 30.")
+    monkeypatch.setattr(finance_agent, "ACTION_QUEUE_MODE", False)
+
+    def post_to_sap(url, payload, idempotency_key=None):
+        raise AssertionError(f"posted {payload}")
+
+    monkeypatch.setattr(finance_agent, "post_to_sap", post_to_sap)
+    request = finance_agent.TaskRequest(task="Submit invoice INV-7 for 99.90")
+    result = finance_agent.run_task(request, None)
+    assert result["action_performed"] == "invoice_rejected"
+    assert "INV-7" in result["message"]
+    assert "error" not in result
@@ -0,0 +1,248 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def hr_agent(gateway, monkeypatch):
+    """One fake HR replica behind the gateway; set .reply to choose what it answers"""
+    class FakeAgent:
+        calls = 0
+        timeouts = []
+        reply = {"result": "20 days of annual leave"}
+        headers = {}
+
+    def handler(request):
+        FakeAgent.calls += 1
+        FakeAgent.timeouts.append(request.extensions["timeout"]["read"])
+        # A stream rather than content, so the gateway can read the body raw as it does from a real agent
+        return httpx.Response(
+            200,
+            headers={"Content-Type": "application/json", "X-Corpus-Version": "v1", **FakeAgent.headers},
+            stream=httpx.ByteStream(json.dumps(FakeAgent.reply).encode())
+        )
+
+    monkeypatch.setattr(gateway, "REGISTRY", gateway.UpstreamRegistry())
+    monkeypatch.setattr(gateway, "RESPONSE_CACHE", gateway.ResponseCache(16, 300))
+    monkeypatch.setattr(gateway, "CORPUS_VERSIONS", {})
+    monkeypatch.setattr(gateway, "HTTP_CLIENT", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    gateway.REGISTRY.configure({"hr": ["http://hr-1"]})
+    monkeypatch.setitem(gateway.LATENCIES, "hr", gateway.LatencyTracker())
+    FakeAgent.upstream = gateway.REGISTRY.upstreams["hr"][0]
+    return FakeAgent
+
+
+def ask(gateway, task="What is the leave policy?"):
+    return TestClient(gateway.app).post("/workflow", json={"domain": "hr", "task": task})
+
+
+def test_informational_answer_is_cached(gateway, hr_agent):
+    first, second = ask(gateway), ask(gateway)
+    assert first.headers["X-Cache"] == "miss"
+    assert second.headers["X-Cache"] == "hit"
+    assert second.json() == hr_agent.reply
+    assert hr_agent.calls == 1
+    assert hr_agent.upstream.breaker.failures == 0
+
+
+def test_agent_error_is_not_cached_and_counts_against_the_breaker(gateway, hr_agent):
+    hr_agent.reply = {"error": "Connection error.", "message": "Internal server error during HR task processing."}
+    hr_agent.headers = {"X-Agent-Error": "true"}
+    for _ in range(2):
+        response = ask(gateway)
+        assert response.json() == hr_agent.reply
+        assert response.headers["X-Agent-Error"] == "true"
+        assert "X-Cache" not in response.headers
+    assert hr_agent.calls == 2
+    assert hr_agent.upstream.breaker.failures == 2
+
+
+def test_breaker_opens_after_consecutive_failures_and_closes_after_a_probe(gateway):
+    breaker = gateway.CircuitBreaker("hr", "http://breaker-test")
+    for _ in range(gateway.BREAKER_FAILURE_THRESHOLD - 1):
+        breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    breaker.opened_at -= gateway.BREAKER_RESET_TIMEOUT_S
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()  # the probe slot is taken until it reports back
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_breaker_reopens_when_the_probe_fails(gateway):
+    breaker = gateway.CircuitBreaker("hr", "http://breaker-test")
+    for _ in range(gateway.BREAKER_FAILURE_THRESHOLD):
+        breaker.record_failure()
+    breaker.opened_at -= gateway.BREAKER_RESET_TIMEOUT_S
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+
+def test_breaker_rearms_a_probe_that_never_reported(gateway):
+    breaker = gateway.CircuitBreaker("hr", "http://breaker-test")
+    for _ in range(gateway.BREAKER_FAILURE_THRESHOLD):
+        breaker.record_failure()
+    breaker.opened_at -= gateway.BREAKER_RESET_TIMEOUT_S
+    assert breaker.allow()
+    assert not breaker.allow()
+    # e.g. the probe lost a hedge race and was cancelled; after another cool-down a new probe goes out
+    breaker.opened_at -= gateway.BREAKER_RESET_TIMEOUT_S
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+
+
+def test_only_informational_calls_get_the_adaptive_timeout(gateway, hr_agent):
+    for _ in range(20):
+        gateway.LATENCIES["hr"].record(0.01)
+    ask(gateway, "What is the leave policy?")
+    ask(gateway, "Submit a leave request")
+    assert hr_agent.timeouts == [gateway.UPSTREAM_TIMEOUT_MIN_S, gateway.UPSTREAM_TIMEOUT_S]
+
+
+@pytest.fixture
+def admission(gateway, monkeypatch):
+    """A controller with one slot and room for two waiters"""
+    monkeypatch.setattr(gateway, "ADMISSION_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(gateway, "ADMISSION_QUEUE_SIZE", 2)
+    return gateway.AdmissionController("hr")
+
+
+def test_admission_evicts_the_lowest_priority_waiter(gateway, admission):
+    async def scenario():
+        await admission.acquire(0, 1)
+        batch = asyncio.create_task(admission.acquire(3, 1))
+        later_batch = asyncio.create_task(admission.acquire(3, 1))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(admission.acquire(0, 1))
+        await asyncio.sleep(0)
+        with pytest.raises(gateway.Overloaded) as evicted:
+            await later_batch
+        assert evicted.value.reason == "evicted"
+        # A full queue refuses anything that does not outrank its worst waiter
+        with pytest.raises(gateway.Overloaded) as refused:
+            await admission.acquire(3, 1)
+        assert refused.value.reason == "queue_full"
+
+        admission.release()
+        await interactive
+        assert not batch.done()
+        admission.release()
+        await batch
+        admission.release()
+        assert admission.in_flight == 0 and not admission.waiters
+
+    asyncio.run(scenario())
+
+
+def test_admission_gives_up_after_the_wait_and_frees_the_queue(gateway, admission):
+    async def scenario():
+        await admission.acquire(0, 1)
+        with pytest.raises(gateway.Overloaded) as timed_out:
+            await admission.acquire(0, 0.01)
+        assert timed_out.value.reason == "timeout"
+        assert not admission.waiters
+        admission.release()
+        assert admission.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_response_cache_expires_entries_after_the_ttl(gateway):
+    cache = gateway.ResponseCache(max_entries=4, ttl_s=300)
+    etag = cache.put(("hr", "leave policy", "text", "v1"), b'{"result": "20 days"}')
+    assert cache.get(("hr", "leave policy", "text", "v1"))[:2] == (b'{"result": "20 days"}', etag)
+    body, etag, stored_at = cache.entries[("hr", "leave policy", "text", "v1")]
+    cache.entries[("hr", "leave policy", "text", "v1")] = (body, etag, stored_at - 301)
+    assert cache.get(("hr", "leave policy", "text", "v1")) is None
+    assert not cache.entries
+
+
+def test_response_cache_evicts_the_least_recently_used(gateway):
+    cache = gateway.ResponseCache(max_entries=2, ttl_s=300)
+    cache.put(("hr", "a", "text", "v1"), b"a")
+    cache.put(("hr", "b", "text", "v1"), b"b")
+    cache.get(("hr", "a", "text", "v1"))
+    cache.put(("hr", "c", "text", "v1"), b"c")
+    assert list(cache.entries) == [("hr", "a", "text", "v1"), ("hr", "c", "text", "v1")]
+
+
+def test_new_corpus_version_drops_only_that_domains_answers(gateway, monkeypatch):
+    cache = gateway.ResponseCache(max_entries=4, ttl_s=300)
+    monkeypatch.setattr(gateway, "RESPONSE_CACHE", cache)
+    monkeypatch.setattr(gateway, "CORPUS_VERSIONS", {"hr": "v1", "finance": "v1"})
+    cache.put(("hr", "a", "text", "v1"), b"a")
+    cache.put(("finance", "a", "text", "v1"), b"a")
+    gateway.update_corpus_version("hr", "v1")
+    assert len(cache.entries) == 2
+    gateway.update_corpus_version("hr", "v2")
+    assert list(cache.entries) == [("finance", "a", "text", "v1")]
+    assert gateway.CORPUS_VERSIONS["hr"] == "v2"
+
+
+@pytest.mark.parametrize("if_none_match, expected", [
+    (None, False),
+    ('W/"abc"', True),
+    ('"abc"', True),  # weak comparison: the gzipped and plain answers share the tag
+    ('"xyz", W/"abc"', True),
+    ("*", True),
+    ('W/"xyz"', False),
+])
+def test_etag_matches(gateway, if_none_match, expected):
+    assert gateway.etag_matches(if_none_match, 'W/"abc"') is expected
+
+
+@pytest.fixture
+def registry(gateway):
+    registry = gateway.UpstreamRegistry()
+    registry.configure({"hr": ["http://hr-1", "http://hr-2", "http://hr-3"]})
+    return registry
+
+
+def test_pick_prefers_the_least_outstanding_healthy_replica(registry):
+    hr1, hr2, hr3 = registry.upstreams["hr"]
+    hr1.outstanding, hr2.outstanding, hr3.outstanding = 2, 0, 1
+    assert registry.pick("hr") is hr2
+    assert registry.pick("hr", exclude={hr2}) is hr3
+    hr3.healthy = False
+    assert registry.pick("hr", exclude={hr2}) is hr1
+    # With every candidate failing its health check the breakers decide
+    hr1.healthy = False
+    assert registry.pick("hr", exclude={hr2}) is hr3
+
+
+def test_pick_skips_replicas_whose_breaker_is_open(gateway, registry):
+    hr1, hr2, hr3 = registry.upstreams["hr"]
+    hr2.outstanding, hr3.outstanding = 1, 2
+    for _ in range(gateway.BREAKER_FAILURE_THRESHOLD):
+        hr1.breaker.record_failure()
+    assert registry.pick("hr") is hr2
+
+
+def test_pick_by_ewma_weighs_latency_by_queued_requests(gateway, registry, monkeypatch):
+    monkeypatch.setattr(gateway, "LB_STRATEGY", "ewma")
+    hr1, hr2, hr3 = registry.upstreams["hr"]
+    hr1.ewma_s, hr1.outstanding = 0.1, 0
+    hr2.ewma_s, hr2.outstanding = 0.01, 3
+    hr3.ewma_s, hr3.outstanding = 0.05, 1
+    assert registry.pick("hr") is hr2
+
+
+def test_pick_with_affinity_keeps_a_session_on_its_replica(registry):
+    home = registry.pick("hr", affinity="session-1")
+    home.outstanding = 10
+    assert registry.pick("hr", affinity="session-1") is home
+    # Removing another replica does not move the session
+    other = next(u for u in registry.upstreams["hr"] if u is not home)
+    registry.configure({"hr": [home.url, other.url]})
+    assert registry.pick("hr", affinity="session-1") is home
+    # Excluding its replica moves it to the one that is left
+    assert registry.pick("hr", exclude={home}, affinity="session-1") is other
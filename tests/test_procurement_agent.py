@@ -0,0 +1,138 @@
+import json
+
+import pytest
+from agent_common import action_queue, sap
+
+
+@pytest.mark.parametrize("task, expected", [
+    (
+        "Place an order for 5 laptops, 10 monitors and 25 keyboards",
+        [("Laptops", 5), ("Monitors", 10), ("Keyboards", 25)]
+    ),
+    ("I need to purchase an order for 20 monitors", [("Monitors", 20)]),
+    ("Order:\n5 laptops\n10 monitors.", [("Laptops", 5), ("Monitors", 10)]),
+])
+def test_parse_order_items_explicit_lists(procurement_agent, task, expected):
+    items = procurement_agent.parse_order_items(task)
+    assert [(item["product"], item["quantity"]) for item in items] == expected
+
+
+@pytest.mark.parametrize("task", [
+    "Please order 5 monitors, delivery within 2 weeks",
+    "Buy 20 chairs for building 7 by 15 March",
+    "Order 10 laptops for 3 new hires",
+    "Place an order for 5 usb cables and 10 monitors",
+    "Order some laptops",
+])
+def test_parse_order_items_falls_back_when_not_a_list(procurement_agent, task):
+    assert procurement_agent.parse_order_items(task) == []
+
+
+def http_part(status, reason, body):
+    return (
+        "Content-Type: application/http\r\n"
+        "Content-Transfer-Encoding: binary\r\n"
+        "\r\n"
+        f"HTTP/1.1 {status} {reason}\r\n"
+        "Content-Type: application/json\r\n"
+        "\r\n"
+        f"{body}\r\n"
+    )
+
+
+def test_parse_batch_response_maps_change_sets_to_items():
+    # Written out by hand rather than with the agent's own encoder
+    body = (
+        "--batchresponse_1\r\n"
+        "Content-Type: multipart/mixed; boundary=changesetresponse_a\r\n"
+        "\r\n"
+        "--changesetresponse_a\r\n"
+        + http_part(201, "Created", '{"id": "PO-1"}')
+        + "--changesetresponse_a\r\n"
+        + http_part(201, "Created", '{"id": "PO-2"}')
+        + "--changesetresponse_a--\r\n"
+        "--batchresponse_1\r\n"
+        + http_part(400, "Bad Request", '{"error": {"message": "Unknown product"}}')
+        + "--batchresponse_1--\r\n"
+    )
+    changesets = [[{"product": "Laptops"}, {"product": "Monitors"}], [{"product": "X"}, {"product": "Y"}]]
+
+    results = sap.parse_batch_response('multipart/mixed; boundary="batchresponse_1"', body, changesets)
+
+    assert results == [
+        (201, {"id": "PO-1"}),
+        (201, {"id": "PO-2"}),
+        # A failed change set is answered once, for all of its items
+        (400, {"error": {"message": "Unknown product"}}),
+        (400, {"error": {"message": "Unknown product"}}),
+    ]
+
+
+def test_parse_batch_response_reports_missing_responses():
+    body = (
+        "--b\r\n"
+        "Content-Type: multipart/mixed; boundary=c\r\n"
+        "\r\n"
+        "--c\r\n"
+        + http_part(201, "Created", '{"id": "PO-1"}')
+        + "--c--\r\n"
+        "--b--\r\n"
+    )
+
+    results = sap.parse_batch_response(
+        "multipart/mixed; boundary=b", body, [[{"n": 1}, {"n": 2}], [{"n": 3}]]
+    )
+
+    assert results == [
+        (201, {"id": "PO-1"}),
+        ("ERROR", "No response for item"),
+        ("ERROR", "No response for change set"),
+    ]
+
+
+def test_parse_batch_response_without_boundary():
+    assert sap.parse_batch_response("application/json", "{}", [[{"n": 1}]]) == [
+        ("ERROR", "No response for change set")
+    ]
+
+
+def test_bulk_job_resends_only_unfinished_items(procurement_agent, monkeypatch, tmp_path):
+    monkeypatch.setattr(action_queue, "ACTION_QUEUE_MODE", True)
+    monkeypatch.setattr(action_queue, "ACTION_QUEUE_DB", str(tmp_path / "queue.db"))
+    monkeypatch.setattr(action_queue.QUEUE_DB, "conn", None, raising=False)
+    sent = []
+
+    def submit_sap_batch(entity_set, items):
+        assert entity_set == "PurchaseOrders"
+        sent.append([item["product"] for item in items])
+        # Monitors fail with a retryable error on the first attempt only
+        return [
+            {
+                "item": item,
+                "sap_api_status": 503 if item["product"] == "Monitors" and len(sent) == 1 else 201,
+                "sap_api_result": None,
+                "succeeded": not (item["product"] == "Monitors" and len(sent) == 1)
+            }
+            for item in items
+        ]
+
+    monkeypatch.setattr(action_queue, "submit_sap_batch", submit_sap_batch)
+    items = [{"product": "Laptops", "quantity": 5}, {"product": "Monitors", "quantity": 10}]
+
+    response = procurement_agent.process_bulk_procurement_action("order", "ok", {}, items, "key-1")
+    job_id = json.loads(response.body)["job_id"]
+    assert response.status_code == 202
+    # Polled through the gateway, which knows which replica holds the job
+    assert json.loads(response.body)["status_url"] == f"/workflow/procurement/jobs/{job_id}"
+
+    action_queue.run_job(action_queue.claim_job())
+    assert action_queue.get_job(job_id)["status"] == "queued"
+    action_queue.queue_db().execute("UPDATE jobs SET next_attempt_at = 0")
+    action_queue.run_job(action_queue.claim_job())
+
+    assert sent == [["Laptops", "Monitors"], ["Monitors"]]
+    assert action_queue.get_job(job_id)["status"] == "succeeded"
+    # A replay returns the same job; the same key for other items is refused
+    replay = procurement_agent.process_bulk_procurement_action("order", "ok", {}, items, "key-1")
+    assert json.loads(replay.body)["job_id"] == job_id
+    assert procurement_agent.process_bulk_procurement_action("order", "ok", {}, items[:1], "key-1").status_code == 422